@@ -0,0 +1,122 @@
+# bench_http.py
+#
+# Compare serving static files and /is_alive through WSGI thread pool (before) with
+# the native front layer (after), while slow control requests hold WSGI threads.
+#
+# Usage:
+#   python3 bench/bench_http.py [--duration 10] [--clients 16] [--blockers 10]
+
+import os, sys, time, json, argparse, subprocess, threading, http.client
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,_root)
+
+PATHS = ( '/suo5/is_alive', '/suo5/favicon.ico', '/suo5/static/config.html',
+  '/suo5/static/common/css/bootstrap.min.css', '/suo5/static/common/js/highlight.min.js' )
+
+def serve(mode, port):   # run in child process, reactor can not restart
+  from flask import Flask
+  from twisted.internet import reactor
+  from twisted.web.resource import Resource
+  from twisted.web.server import Site
+  from twisted.web.wsgi import WSGIResource
+  from suo5.static_cache import StaticCache, FrontResource
+
+  static_dir = os.path.join(_root,'suo5','static')
+  app = Flask(__name__,static_folder=static_dir,static_url_path='/static')
+
+  @app.route('/is_alive')
+  def is_alive():
+    return 'OK'
+
+  @app.route('/favicon.ico')
+  def favicon():
+    return app.send_static_file('favicon.ico')
+
+  @app.route('/slow')
+  def slow():   # like start_suo5_client() that blocks a WSGI thread
+    time.sleep(0.5)
+    return 'DONE'
+
+  site = WSGIResource(reactor,reactor.getThreadPool(),app)
+  if mode == 'front':
+    site = FrontResource(site,StaticCache(static_dir).build(),'/static')
+    site.add_route('/is_alive',lambda request: b'OK')
+    site.add_route('/favicon.ico',lambda request: site.static.render_GET(request,'favicon.ico'))
+
+  root = Resource()
+  root.putChild(b'suo5',site)
+  reactor.listenTCP(port,Site(root),interface='127.0.0.1')
+  reactor.run()
+
+def _client(port, paths, deadline, latencies, errors):
+  conn = http.client.HTTPConnection('127.0.0.1',port,timeout=30)
+  i = 0
+  while time.monotonic() < deadline:
+    path = paths[i % len(paths)]; i += 1
+    start = time.perf_counter()
+    try:
+      conn.request('GET',path,headers={'Accept-Encoding':'gzip'})
+      res = conn.getresponse()
+      res.read()
+      if res.status != 200:
+        errors.append(res.status)
+        continue
+    except (OSError,http.client.HTTPException) as e:
+      errors.append(str(e))
+      conn.close()
+      conn = http.client.HTTPConnection('127.0.0.1',port,timeout=30)
+      continue
+    if latencies is not None:
+      latencies.append(time.perf_counter() - start)
+  conn.close()
+
+def _percentile(values, q):
+  if not values: return 0
+  values = sorted(values)
+  return values[min(len(values) - 1,int(q * len(values)))]
+
+def run(mode, port, duration, clients, blockers):
+  proc = subprocess.Popen([sys.executable,__file__,'--serve',mode,'--port',str(port)],
+    stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+  try:
+    for i in range(100):   # wait listening
+      try:
+        c = http.client.HTTPConnection('127.0.0.1',port,timeout=1)
+        c.request('GET','/suo5/is_alive'); c.getresponse().read(); c.close()
+        break
+      except OSError:
+        time.sleep(0.1)
+
+    latencies = []; errors = []
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=_client,args=(port,['/suo5/slow'],deadline,None,errors)) for i in range(blockers)]
+    threads += [threading.Thread(target=_client,args=(port,PATHS[i % len(PATHS):] + PATHS[:i % len(PATHS)],deadline,latencies,errors))
+      for i in range(clients)]
+    for th in threads: th.start()
+    for th in threads: th.join()
+
+    return { 'mode': mode, 'requests': len(latencies), 'rps': round(len(latencies) / duration,1),
+      'p50_ms': round(_percentile(latencies,0.5) * 1000,2), 'p99_ms': round(_percentile(latencies,0.99) * 1000,2),
+      'errors': len(errors) }
+  finally:
+    proc.terminate()
+    proc.wait()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--serve',choices=('wsgi','front'))
+  parser.add_argument('--port',type=int,default=18710)
+  parser.add_argument('--duration',type=float,default=10)
+  parser.add_argument('--clients',type=int,default=16)
+  parser.add_argument('--blockers',type=int,default=10,help='clients keep calling a slow WSGI route')
+  args = parser.parse_args()
+
+  if args.serve:
+    serve(args.serve,args.port)
+  else:
+    results = [run(mode,args.port,args.duration,args.clients,args.blockers) for mode in ('wsgi','front')]
+    print('%-6s %10s %10s %10s %8s' % ('mode','req/s','p50(ms)','p99(ms)','errors'))
+    for r in results:
+      print('%-6s %10s %10s %10s %8s' % (r['mode'],r['rps'],r['p50_ms'],r['p99_ms'],r['errors']))
+    print(json.dumps(results))
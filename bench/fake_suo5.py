@@ -0,0 +1,27 @@
+# fake_suo5.py
+#
+# stand-in of suo5 client binary: listens SOCKS5 at '-l host:port' and connects targets directly
+# usage: fake_suo5.py <argv0> -t <url> -l <host:port> --ua <ua> [--auth user:passw] ...
+
+import os, sys, time, asyncio
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from standin import socks5_handler
+
+def main():
+  args = sys.argv[2:]
+  host, port = args[args.index('-l') + 1].rsplit(':',maxsplit=1)
+  auth = args[args.index('--auth') + 1] if '--auth' in args else ''
+  print('fake suo5 client listen at %s:%s' % (host,port),flush=True)
+
+  def log(level, msg):   # same format as suo5 client, errors go to stderr
+    out = sys.stderr if level == 'ERRO' else sys.stdout
+    print('[%s] %s %s' % (level,time.strftime('%Y/%m/%d %H:%M'),msg),file=out,flush=True)
+
+  async def serve():
+    server = await asyncio.start_server(socks5_handler(auth,log),host,int(port),reuse_address=True)
+    await server.serve_forever()
+  asyncio.run(serve())
+
+if __name__ == '__main__':
+  main()
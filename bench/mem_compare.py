@@ -0,0 +1,114 @@
+# mem_compare.py
+#
+# Memory of hosting several dapps: one dapps.py process per dapp against one process hosting all of them.
+# The dapps are copies of suo5 in a bench workspace, every copy has its own config.json and front listener.
+#
+# Usage:
+#   python3 bench/mem_compare.py [--dapps 3] [--settle 2] [--output mem.json]
+
+import os, sys, json, time, argparse
+
+_bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,_bench_dir)
+
+from run_bench import Workspace, _free_port, _http
+
+def _proc_mem(pid):   # {rss_kb,pss_kb,threads} from /proc, pss is shared pages divided by sharers
+  ret = {'rss_kb': None, 'pss_kb': None, 'threads': None}
+  try:
+    with open('/proc/%i/status' % pid,'rt') as f:
+      for line in f:
+        if line.startswith('VmRSS:'): ret['rss_kb'] = int(line.split()[1])
+        elif line.startswith('Threads:'): ret['threads'] = int(line.split()[1])
+    with open('/proc/%i/smaps_rollup' % pid,'rt') as f:
+      for line in f:
+        if line.startswith('Pss:'): ret['pss_kb'] = int(line.split()[1])
+  except (OSError,ValueError): pass
+  return ret
+
+def _add_dapp(ws, name, socks_port):   # another dapp that links to sources of workspace 'suo5'
+  src_dir = os.path.join(ws.dir,'suo5')
+  app_dir = os.path.join(ws.dir,name)
+  if name != 'suo5':
+    os.mkdir(app_dir)
+    for item in os.listdir(src_dir):
+      if item != 'config.json': os.symlink(os.path.join(src_dir,item),os.path.join(app_dir,item))
+
+  with open(os.path.join(src_dir,'config.json'),'rt') as f:
+    cfg = json.load(f)
+  cfg.update(suo5_local_host='127.0.0.1:%i' % socks_port,auto_start_suo5=False)   # only cost of hosting
+  with open(os.path.join(app_dir,'config.json'),'wt') as f:
+    json.dump(cfg,f,indent=2)
+
+def _wait_ready(port, names, proc, timeout=60):
+  deadline = time.monotonic() + timeout
+  pending = list(names)
+  while pending and time.monotonic() < deadline and proc.poll() is None:
+    try:
+      if _http(port,'GET','/%s/is_alive' % pending[0],timeout=1)[0] == 200:
+        pending.pop(0)
+        continue
+    except OSError: pass
+    time.sleep(0.05)
+  return not pending
+
+def _total(items):
+  ret = {}
+  for k in ('rss_kb','pss_kb','threads'):
+    values = [item[k] for item in items]
+    ret[k] = None if None in values else sum(values)
+  return ret
+
+def measure(ws, names, shared, settle):
+  procs = []
+  try:
+    if shared:
+      port = _free_port()
+      proc = ws.start(port,*names)
+      procs.append(proc)
+      if not _wait_ready(port,names,proc): raise RuntimeError('dapps not ready, see logs in %s' % ws.dir)
+    else:
+      for name in names:
+        port = _free_port()
+        proc = ws.start(port,name)
+        procs.append(proc)
+        if not _wait_ready(port,[name],proc): raise RuntimeError('%s not ready, see logs in %s' % (name,ws.dir))
+
+    time.sleep(settle)   # let background tasks of dapps start
+    items = [_proc_mem(proc.pid) for proc in procs]
+    return dict(_total(items),processes=len(procs),dapps=len(names),per_process=items)
+  finally:
+    for proc in procs: ws.stop(proc)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--dapps',type=int,default=3,help='number of dapps')
+  parser.add_argument('--settle',type=float,default=2,help='seconds to wait after dapps are ready')
+  parser.add_argument('--output',help='JSON file of results')
+  args = parser.parse_args()
+
+  ws = Workspace(_free_port(),_free_port())
+  try:
+    names = ['suo5'] + ['suo5%s' % chr(ord('b') + i) for i in range(args.dapps - 1)]
+    for name in names: _add_dapp(ws,name,_free_port())
+
+    ret = { 'dapps': names,
+      'separate': measure(ws,names,False,args.settle),
+      'shared': measure(ws,names,True,args.settle) }
+  finally:
+    ws.cleanup()
+
+  mb = lambda kb: '-' if kb is None else '%.1f' % (kb / 1024)
+  print('%-10s %9s %8s %8s %8s' % ('mode','processes','RSS MB','PSS MB','threads'))
+  for mode in ('separate','shared'):
+    r = ret[mode]
+    print('%-10s %9i %8s %8s %8s' % (mode,r['processes'],mb(r['rss_kb']),mb(r['pss_kb']),r['threads']))
+  if ret['separate']['pss_kb'] and ret['shared']['pss_kb']:
+    print('\nshared process saves %s MB PSS for %i dapps' % (mb(ret['separate']['pss_kb'] - ret['shared']['pss_kb']),len(names)))
+
+  if args.output:
+    with open(args.output,'wt') as f:
+      json.dump(ret,f,indent=2)
+
+if __name__ == '__main__':
+  main()
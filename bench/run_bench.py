@@ -0,0 +1,417 @@
+# run_bench.py
+#
+# Benchmark dapps.py in local mode (LISTEN_PORT) with stand-ins: stub nbcc.dapp_lib, fake suo5 client binary,
+# stand-in suo5 server and SOCKS5 echo target. Results are saved as JSON for comparing across commits.
+#
+# Usage:
+#   python3 bench/run_bench.py [--duration 5] [--clients 8] [--backends 1] [--output result.json]
+#   python3 bench/run_bench.py --compare old.json new.json
+
+import os, sys, json, time, signal, shutil, socket, asyncio, argparse, platform, tempfile, subprocess, threading
+import http.client
+
+_bench_dir = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.dirname(_bench_dir)
+sys.path.insert(0,_bench_dir)
+sys.path.insert(1,_root)
+
+from standin import start_suo5_server, start_echo_server, socks5_echo
+from bench_http import _client, _percentile
+
+def _free_port():
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1',0))
+    return sock.getsockname()[1]
+
+def _ms(seconds):
+  return round(seconds * 1000,2)
+
+def _summary(values):   # values in seconds
+  if not values: return {'count': 0}
+  return { 'count': len(values), 'p50_ms': _ms(_percentile(values,0.5)), 'p99_ms': _ms(_percentile(values,0.99)),
+    'max_ms': _ms(max(values)) }
+
+def _http(port, method, path, body=None, timeout=5):
+  conn = http.client.HTTPConnection('127.0.0.1',port,timeout=timeout)
+  try:
+    conn.request(method,path,body=body)
+    res = conn.getresponse()
+    return res.status, res.read()
+  finally:
+    conn.close()
+
+def _alive(port):
+  try:
+    return _http(port,'GET','/suo5/is_alive',timeout=1)[0] == 200
+  except OSError:
+    return False
+
+def _http_json(port, method, path, body=None):
+  status, data = _http(port,method,path,body)
+  return status, (json.loads(data) if data[:1] == b'{' else data)
+
+def _cpu_seconds(pid):   # utime + stime of a process, None when /proc not available
+  try:
+    with open('/proc/%i/stat' % pid,'rb') as f:
+      fields = f.read().rsplit(b')',1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+  except (OSError,ValueError,IndexError):
+    return None
+
+class Workspace:   # temporary copy of dapp, its suo5 binary is replaced by fake_suo5.py
+  def __init__(self, server_port, socks_port, backend_num=1):
+    self.dir = tempfile.mkdtemp(prefix='suo5-bench-')
+    self.home = os.path.join(self.dir,'home')
+    os.makedirs(os.path.join(self.home,'red-brick','var'))
+    self.procs = []
+
+    app_dir = os.path.join(self.dir,'suo5')
+    os.mkdir(app_dir)
+    src_dir = os.path.join(_root,'suo5')
+    for name in os.listdir(src_dir):
+      if name in ('config.json','__pycache__') or name.startswith('suo5-'): continue
+      os.symlink(os.path.join(src_dir,name),os.path.join(app_dir,name))
+
+    with open(os.path.join(src_dir,'config.json'),'rt') as f:
+      cfg = json.load(f)
+    cfg.update( suo5_server_url='http://127.0.0.1:%i/stream' % server_port,
+      suo5_local_host='127.0.0.1:%i' % socks_port, auto_start_suo5=True, client_user_psw='',
+      backend_num=backend_num )
+    with open(os.path.join(app_dir,'config.json'),'wt') as f:
+      json.dump(cfg,f,indent=2)
+
+    fake = os.path.join(_bench_dir,'fake_suo5.py')
+    for name in ('suo5-linux-amd64','suo5-linux-arm64','suo5-darwin-amd64'):
+      path = os.path.join(app_dir,name)
+      with open(path,'wt') as f:
+        f.write('#!/bin/sh\nexec "%s" "%s" "$0" "$@"\n' % (sys.executable,fake))
+      os.chmod(path,0o755)
+    shutil.copy(os.path.join(_root,'dapps.py'),self.dir)
+
+  def env(self, **kwargs):
+    env = dict(os.environ,HOME=self.home,PYTHONPATH=os.pathsep.join((os.path.join(_bench_dir,'stub'),self.dir)))
+    env.update(kwargs)
+    return env
+
+  def start(self, port, *names, **env):   # dapps.py hosts 'suo5' or the given dapps
+    log = open(os.path.join(self.dir,'dapps_%i.log' % port),'wb')
+    proc = subprocess.Popen([sys.executable,'-u','dapps.py'] + list(names or ('suo5',)),cwd=self.dir,
+      env=self.env(LISTEN_PORT=str(port),**env),stdout=log,stderr=subprocess.STDOUT)
+    log.close()
+    self.procs.append(proc)
+    return proc
+
+  def stop(self, proc):
+    proc.terminate()
+    try:
+      proc.wait(5)
+    except subprocess.TimeoutExpired:
+      proc.kill()
+      proc.wait()
+    self.kill_clients()
+
+  def client_pids(self):   # fake suo5 clients started by dapp in this workspace
+    ret = []
+    tag = (os.path.join(self.dir,'suo5','suo5-')).encode('utf-8')
+    for item in os.listdir('/proc'):
+      if not item.isdigit(): continue
+      try:
+        with open('/proc/%s/cmdline' % item,'rb') as f:
+          if tag in f.read(): ret.append(int(item))
+      except OSError: pass
+    return ret
+
+  def kill_clients(self, sig=signal.SIGKILL):
+    for pid in self.client_pids():
+      try:
+        os.kill(pid,sig)
+      except OSError: pass
+
+  def cleanup(self):
+    for proc in self.procs:
+      if proc.poll() is None: self.stop(proc)
+    self.kill_clients()
+    shutil.rmtree(self.dir,ignore_errors=True)
+
+#---- measurements
+
+def bench_cold_start(ws, runs):
+  ret = []
+  for i in range(runs):
+    port = _free_port()
+    start = time.perf_counter()
+    proc = ws.start(port)
+    listen = ready = None
+    while time.perf_counter() - start < 30 and proc.poll() is None:
+      try:
+        status, _ = _http(port,'GET','/suo5/is_alive',timeout=1)
+        if listen is None: listen = time.perf_counter() - start
+        if status == 200:
+          ready = time.perf_counter() - start
+          break
+      except OSError: pass
+      time.sleep(0.01)
+
+    report = None
+    if ready is not None:
+      status, report = _http_json(port,'GET','/suo5/startup')
+    ws.stop(proc)
+    ret.append({ 'listen_ms': _ms(listen) if listen is not None else None,
+      'ready_ms': _ms(ready) if ready is not None else None, 'report': report if isinstance(report,dict) else None })
+
+  readys = sorted(r['ready_ms'] for r in ret if r['ready_ms'] is not None)
+  listens = sorted(r['listen_ms'] for r in ret if r['listen_ms'] is not None)
+  return { 'runs': ret, 'ready_ms': readys[len(readys) // 2] if readys else None,
+    'listen_ms': listens[len(listens) // 2] if listens else None }
+
+def bench_http(port, paths, duration, clients):
+  latencies = []; errors = []
+  deadline = time.monotonic() + duration
+  threads = [threading.Thread(target=_client,args=(port,paths,deadline,latencies,errors)) for i in range(clients)]
+  for th in threads: th.start()
+  for th in threads: th.join()
+  return dict(_summary(latencies),rps=round(len(latencies) / duration,1),errors=len(errors))
+
+def bench_probe(socks_port, server_url, pid, count):
+  from suo5.prober import Suo5Prober
+  async def run(keepalive):
+    prober = Suo5Prober(timeout=5)
+    ret = []; failed = 0
+    for i in range(count):
+      if not keepalive:
+        prober = Suo5Prober(timeout=5)
+      prober.config('127.0.0.1:%i' % socks_port,server_url)
+      start = time.perf_counter()
+      ok, ms, err = await prober.probe_once('bench')
+      ret.append(time.perf_counter() - start)
+      if not ok: failed += 1
+    prober._drop_conn()
+    return dict(_summary(ret),failed=failed)
+
+  ret = {}
+  for name, keepalive in (('keepalive',True),('fresh',False)):
+    cpu = _cpu_seconds(pid)
+    ret[name] = asyncio.run(run(keepalive))
+    if cpu is not None:   # cost in dapp process, front listener forwards every probe
+      ret[name]['dapp_cpu_ms_per_probe'] = round((_cpu_seconds(pid) - cpu) * 1000 / count,3)
+  return ret
+
+class _Traffic(threading.Thread):   # keep making short connections through tunnel
+  def __init__(self, proxy, target, interval=0.01):
+    threading.Thread.__init__(self,name='BenchTraffic')
+    self.daemon = True
+    self.proxy = proxy
+    self.target = target
+    self.interval = interval
+    self.events = []   # [(time,ok)]
+    self.stopped = threading.Event()
+
+  def run(self):
+    while not self.stopped.is_set():
+      tm = time.monotonic()
+      try:
+        socks5_echo(self.proxy,self.target,timeout=2)
+        ok = True
+      except OSError:
+        ok = False
+      self.events.append((tm,ok))
+      time.sleep(self.interval)
+
+  def downtime(self, since):   # failed connections and longest gap between successful ones after since
+    events = [e for e in self.events if e[0] >= since]
+    last_ok = since; gap = 0
+    for tm, ok in events:
+      if ok:
+        gap = max(gap,tm - last_ok)
+        last_ok = tm
+    return { 'connections': len(events), 'failed': sum(1 for e in events if not e[1]), 'max_gap_ms': _ms(gap) }
+
+def _wait(fn, timeout, interval=0.05):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    ret = fn()
+    if ret: return ret
+    time.sleep(interval)
+  return None
+
+def _wait_active(port, active=True, timeout=30):
+  def check():
+    try:
+      status, state = _http_json(port,'GET','/suo5/state')
+      return status == 200 and state.get('active') == active
+    except OSError: return False
+  return _wait(check,timeout)
+
+def bench_rotation(port, traffic):   # toggle user_agent, it is in command line of suo5 client, so clients rotate
+  status, state = _http_json(port,'GET','/suo5/state')
+  rotations = state['metrics']['rotations']
+  ex_opt = dict(state['ex_opt'])
+  ua = ex_opt['user_agent']
+  ex_opt['user_agent'] = ua[:-6] if ua.endswith(' bench') else ua + ' bench'
+
+  start = time.monotonic()
+  status, ret = _http_json(port,'POST','/suo5/change_exopt',json.dumps(ex_opt).encode('utf-8'))
+  job = ret.get('job') if isinstance(ret,dict) else None
+  if not job: raise RuntimeError('no rotation job: %s %s' % (status,ret))
+
+  def job_done():
+    status, info = _http_json(port,'GET','/suo5/jobs/%s' % job)
+    return info if info.get('state') in ('done','failed') else None
+  info = _wait(job_done,60)
+  job_ms = round((time.monotonic() - start) * 1000,1)
+  time.sleep(0.5)
+  state = _http_json(port,'GET','/suo5/state')[1]
+  if state['metrics']['rotations'] <= rotations: raise RuntimeError('suo5 clients not rotated')
+  return dict(traffic.downtime(start),status=status,job_state=info and info['state'],job_ms=job_ms)
+
+def bench_restart(ws, traffic):
+  start = time.monotonic()
+  ws.kill_clients()
+  recovered = _wait(lambda: traffic.events and traffic.events[-1][1] and traffic.events[-1][0] > start + 0.05,60)
+  time.sleep(0.5)
+  return dict(traffic.downtime(start),recovered=bool(recovered))
+
+def bench_token(ws, lines):
+  ret = subprocess.run([sys.executable,os.path.abspath(__file__),'--token-bench',str(lines)],cwd=ws.dir,
+    env=ws.env(),capture_output=True,timeout=300)
+  try:
+    return json.loads(ret.stdout.decode('utf-8').strip().splitlines()[-1])
+  except (ValueError,IndexError):
+    return {'error': ret.stderr.decode('utf-8')[-2000:]}
+
+def token_bench(lines):   # run in workspace, cost of check_token_ok() with large login file
+  import importlib.util
+  sys.argv = ['dapps.py','suo5']
+  spec = importlib.util.spec_from_file_location('dapps',os.path.join(os.getcwd(),'dapps.py'))
+  dapps = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(dapps)
+
+  now = int(time.time())
+  with open(dapps._rb_var_file,'wt') as f:
+    for i in range(lines):
+      f.write('%i,tok%08x\n' % (now - lines + i,i))
+
+  store = dapps._token_store
+  start = time.perf_counter()
+  store.tail = dapps._file_watcher.watch(dapps._rb_var_file,store.on_lines)
+  load = time.perf_counter() - start
+
+  class Req:
+    def __init__(self, tok): self.cookies = {'_tee_tok_': tok}
+
+  def per_call(fn, n):
+    start = time.perf_counter()
+    for i in range(n): fn(i)
+    return round((time.perf_counter() - start) * 1e6 / n,2)
+
+  hit = Req('tok%08x' % (lines - 1))
+  bad = Req('not-a-token')
+  ret = { 'lines': lines, 'load_ms': _ms(load),
+    'hit_us': per_call(lambda i: dapps.check_token_ok(hit),100000),
+    'first_miss_us': per_call(lambda i: dapps.check_token_ok(Req('unknown%i' % i)),2000),
+    'bad_hit_us': per_call(lambda i: dapps.check_token_ok(bad),100000) }
+
+  def append_and_check(i):
+    tok = 'new%08x' % i
+    with open(dapps._rb_var_file,'at') as f:
+      f.write('%i,%s\n' % (int(time.time()),tok))
+    assert dapps.check_token_ok(Req(tok))
+  ret['appended_us'] = per_call(append_and_check,500)
+  ret['stats'] = store.stats()
+  print(json.dumps(ret))
+
+#----
+
+def run_all(args):
+  server_port, socks_port, echo_port, port = _free_port(), _free_port(), _free_port(), _free_port()
+  start_suo5_server(server_port)
+  start_echo_server(echo_port)
+  ws = Workspace(server_port,socks_port,args.backends)
+  ret = { 'commit': _git_commit(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+    'platform': '%s %s' % (platform.system(),platform.machine()),
+    'params': dict(duration=args.duration,clients=args.clients,backends=args.backends,
+      token_lines=args.token_lines,probes=args.probes) }
+  try:
+    print('cold start ...'); ret['cold_start'] = bench_cold_start(ws,args.runs)
+
+    proc = ws.start(port,IGNORE_TEE_TOK='1')
+    if not _wait(lambda: proc.poll() is not None or _alive(port),30) or proc.poll() is not None:
+      raise RuntimeError('dapp not started')
+    start = time.monotonic()
+    with open(os.path.join(ws.home,'red-brick','var','.tr_login'),'at') as f:   # credential triggers starting client
+      f.write('%i,00112233,127.0.0.1,%i\n' % (int(time.time()),server_port))
+    if not _wait_active(port): raise RuntimeError('suo5 client not started')
+    ret['tunnel_up_ms'] = round((time.monotonic() - start) * 1000,1)
+
+    for name, paths in ( ('is_alive',['/suo5/is_alive']), ('state',['/suo5/state']),
+        ('static',['/suo5/static/common/css/bootstrap.min.css','/suo5/static/config.html','/suo5/favicon.ico']) ):
+      print('http %s ...' % name)
+      ret.setdefault('http',{})[name] = bench_http(port,paths,args.duration,args.clients)
+
+    print('probe ...')
+    ret['probe'] = bench_probe(socks_port,'http://127.0.0.1:%i/stream' % server_port,proc.pid,args.probes)
+
+    traffic = _Traffic(('127.0.0.1',socks_port),('127.0.0.1',echo_port))
+    traffic.start()
+    time.sleep(1)
+    print('rotation ...'); ret['rotation'] = bench_rotation(port,traffic)
+    time.sleep(2)   # old group drained
+    print('restart ...'); ret['restart'] = bench_restart(ws,traffic)
+    traffic.stopped.set()
+    ws.stop(proc)
+
+    print('token ...'); ret['token'] = bench_token(ws,args.token_lines)
+  finally:
+    ws.cleanup()
+  return ret
+
+def _git_commit():
+  try:
+    return subprocess.run(['git','rev-parse','--short','HEAD'],cwd=_root,capture_output=True).stdout.decode('utf-8').strip()
+  except OSError:
+    return ''
+
+def _flatten(d, prefix=''):
+  ret = {}
+  for k, v in d.items():
+    if k in ('runs','report','params','stats'): continue
+    if isinstance(v,dict):
+      ret.update(_flatten(v,prefix + k + '.'))
+    elif isinstance(v,(int,float)) and not isinstance(v,bool):
+      ret[prefix + k] = v
+  return ret
+
+def compare(old_file, new_file):
+  with open(old_file) as f: old = json.load(f)
+  with open(new_file) as f: new = json.load(f)
+  a, b = _flatten(old), _flatten(new)
+  print('%-40s %12s %12s %9s' % ('metric',old.get('commit','old'),new.get('commit','new'),'change'))
+  for k in sorted(set(a) | set(b)):
+    va, vb = a.get(k), b.get(k)
+    change = '%+.1f%%' % ((vb - va) * 100 / va) if va and vb is not None else ''
+    print('%-40s %12s %12s %9s' % (k,'' if va is None else va,'' if vb is None else vb,change))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--duration',type=float,default=5,help='seconds of every http test')
+  parser.add_argument('--clients',type=int,default=8)
+  parser.add_argument('--backends',type=int,default=1,help='backend_num of config.json')
+  parser.add_argument('--runs',type=int,default=3,help='runs of cold start')
+  parser.add_argument('--probes',type=int,default=200)
+  parser.add_argument('--token-lines',type=int,default=100000)
+  parser.add_argument('--output',help='JSON file, default is bench_<commit>.json')
+  parser.add_argument('--compare',nargs=2,metavar=('OLD','NEW'))
+  parser.add_argument('--token-bench',type=int,help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.token_bench:
+    token_bench(args.token_bench)
+  elif args.compare:
+    compare(*args.compare)
+  else:
+    ret = run_all(args)
+    output = args.output or 'bench_%s.json' % (ret['commit'] or 'local')
+    with open(output,'wt') as f:
+      json.dump(ret,f,indent=2)
+    print(json.dumps({k: v for k, v in _flatten(ret).items()},indent=1))
+    print('saved to %s' % output)
@@ -0,0 +1,137 @@
+# standin.py
+#
+# local stand-ins used by benchmark: suo5 server, SOCKS5 echo target and a SOCKS5 server that acts like suo5 client
+
+import socket, struct, asyncio, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+_BLOCK = bytes(range(256)) * 256   # 64 KB
+
+class _Suo5Handler(BaseHTTPRequestHandler):   # answer 'OK,<ip>,<port>' like suo5 server does
+  protocol_version = 'HTTP/1.1'
+
+  def _download(self, size):   # GET /download?bytes=N, target of tuning throughput
+    self.send_response(200)
+    self.send_header('Content-Length',str(size))
+    self.end_headers()
+    while size > 0:
+      self.wfile.write(_BLOCK[:size])
+      size -= len(_BLOCK)
+
+  def _answer(self):
+    length = int(self.headers.get('Content-Length') or 0)
+    if length: self.rfile.read(length)
+    if self.path.startswith('/download?bytes='):
+      return self._download(int(self.path.split('=',1)[1]))
+    body = ('OK,127.0.0.1,%i' % self.server.server_address[1]).encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Length',str(len(body)))
+    self._headers_buffer.append(b'\r\n' + body)   # one write, avoid delayed ACK on keep-alive connection
+    self.flush_headers()
+
+  do_GET = do_POST = _answer
+
+  def log_message(self, *args): pass
+
+def start_suo5_server(port):
+  server = ThreadingHTTPServer(('127.0.0.1',port),_Suo5Handler)
+  server.daemon_threads = True
+  th = threading.Thread(target=server.serve_forever,name='StandinSuo5')
+  th.daemon = True
+  th.start()
+  return server
+
+async def _echo(reader, writer):
+  try:
+    while True:
+      data = await reader.read(65536)
+      if not data: break
+      writer.write(data)
+      await writer.drain()
+  except OSError: pass
+  finally: writer.close()
+
+def start_echo_server(port):   # run in own loop thread
+  loop = asyncio.new_event_loop()
+  ready = threading.Event()
+  async def main():
+    await asyncio.start_server(_echo,'127.0.0.1',port)
+    ready.set()
+  th = threading.Thread(target=lambda: (loop.run_until_complete(main()),loop.run_forever()),name='StandinEcho')
+  th.daemon = True
+  th.start()
+  ready.wait(5)
+  return loop
+
+async def _pipe(reader, writer):
+  try:
+    while True:
+      data = await reader.read(65536)
+      if not data: break
+      writer.write(data)
+      await writer.drain()
+  except OSError: pass
+  finally: writer.close()
+
+def socks5_handler(auth='', log=None):   # SOCKS5 server that connects targets directly, log(level,msg) like suo5 client
+  async def handle(reader, writer):
+    try:
+      ver, n = await reader.readexactly(2)
+      methods = await reader.readexactly(n)
+      if auth:
+        writer.write(b'\x05\x02'); await writer.drain()
+        await reader.readexactly(1)
+        user = await reader.readexactly((await reader.readexactly(1))[0])
+        passw = await reader.readexactly((await reader.readexactly(1))[0])
+        ok = '%s:%s' % (user.decode('utf-8'),passw.decode('utf-8')) == auth
+        writer.write(b'\x01' + (b'\x00' if ok else b'\x01')); await writer.drain()
+        if not ok:
+          writer.close()
+          return
+      else:
+        writer.write(b'\x05\x00'); await writer.drain()
+
+      head = await reader.readexactly(4)
+      if head[3] == 1:
+        host = socket.inet_ntoa(await reader.readexactly(4))
+      elif head[3] == 3:
+        host = (await reader.readexactly((await reader.readexactly(1))[0])).decode('utf-8')
+      else:
+        host = socket.inet_ntop(socket.AF_INET6,await reader.readexactly(16))
+      port = struct.unpack('>H',await reader.readexactly(2))[0]
+      peer = '%s:%s' % writer.get_extra_info('peername')[:2]
+      if log: log('INFO','new connection from %s to %s:%i' % (peer,host,port))
+
+      try:
+        up_reader, up_writer = await asyncio.open_connection(host,port)
+      except OSError as e:
+        if log: log('ERRO','dial %s:%i failed: %s' % (host,port,e))
+        writer.write(b'\x05\x05\x00\x01' + bytes(6)); await writer.drain()
+        writer.close()
+        return
+      if log: log('INFO','connected to %s:%i' % (host,port))
+      writer.write(b'\x05\x00\x00\x01' + bytes(6)); await writer.drain()
+      await asyncio.gather(_pipe(reader,up_writer),_pipe(up_reader,writer))
+      if log: log('INFO','connection to %s:%i closed' % (host,port))
+    except (OSError,asyncio.IncompleteReadError):
+      writer.close()
+  return handle
+
+def socks5_echo(proxy, target, data=b'ping', timeout=3):   # one round trip through SOCKS5 proxy, raise error when failed
+  with socket.create_connection(proxy,timeout=timeout) as sock:
+    sock.sendall(b'\x05\x01\x00')
+    if sock.recv(2) != b'\x05\x00': raise OSError('socks5 handshake failed')
+    sock.sendall(b'\x05\x01\x00\x01' + socket.inet_aton(target[0]) + struct.pack('>H',target[1]))
+    reply = b''
+    while len(reply) < 10:
+      b = sock.recv(10 - len(reply))
+      if not b: raise OSError('socks5 connect closed')
+      reply += b
+    if reply[1] != 0: raise OSError('socks5 connect failed: %i' % reply[1])
+    sock.sendall(data)
+    got = b''
+    while len(got) < len(data):
+      b = sock.recv(65536)
+      if not b: raise OSError('echo closed')
+      got += b
+    if got != data: raise OSError('echo mismatch')
@@ -0,0 +1 @@
+# stand-in of nbcc package, only for benchmark in local mode
@@ -0,0 +1,15 @@
+# dapp_cfg.py
+
+import json
+
+class DappConfig(dict):
+  @classmethod
+  def load(cls, name, readonly, path):
+    with open(path,'rt') as f:
+      cfg = cls(json.load(f))
+    cfg._path = path
+    return cfg
+
+  def save(self):
+    with open(self._path,'wt') as f:
+      json.dump(dict(self),f,indent=2)
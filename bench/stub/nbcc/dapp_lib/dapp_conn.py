@@ -0,0 +1,23 @@
+# dapp_conn.py
+
+from twisted.internet.protocol import ClientFactory, Protocol
+
+class HttpCtrlBlock:
+  def __init__(self, name, conn_num, flag, cred_1, cred_2, cred_sig):
+    self.conn_num = conn_num
+    self.conns = []
+
+class _RelayProtocol(Protocol):
+  def connectionMade(self):
+    self.factory.HCB.conns.append(self)
+
+  def connectionLost(self, reason):
+    if self in self.factory.HCB.conns:
+      self.factory.HCB.conns.remove(self)
+
+class MyHttpFactory(ClientFactory):
+  protocol = _RelayProtocol
+
+  def __init__(self, site, HCB):
+    self.site = site
+    self.HCB = HCB
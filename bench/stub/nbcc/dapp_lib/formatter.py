@@ -0,0 +1,9 @@
+# formatter.py
+
+__all__ = [ 'compose', 'NI', 'VarStr' ]
+
+def compose(fields):
+  return lambda cls: cls
+
+NI = int
+VarStr = bytes
@@ -13,6 +13,32 @@ logging.basicConfig(level=logging.INFO,format=_log_fmt)
 
 logger = logging.getLogger(__name__)
 
+#---- startup timing
+
+import time
+
+class _StartupTimer:   # record time of every startup phase, so slow startup can be tracked
+  def __init__(self):
+    self.t0 = self.last = time.monotonic()
+    self.phases = []    # [(name,ms,parallel)]
+    self.ready = False
+  
+  def mark(self, name, start=None):   # phase ends now, it starts from last mark, or from start when run in parallel
+    now = time.monotonic()
+    self.phases.append((name,round((now - (start or self.last)) * 1000,1),start is not None))
+    if start is None: self.last = now
+  
+  def finish(self):
+    self.ready = True
+    logger.info('startup in %.0f ms: %s',(self.last - self.t0) * 1000,
+      ', '.join('%s%s=%.0fms' % (name,'(parallel)' if par else '',ms) for name, ms, par in self.phases))
+  
+  def report(self):
+    return { 'ready': self.ready, 'total_ms': round((self.last - self.t0) * 1000,1),
+      'phases': [dict(name=name,ms=ms,parallel=par) for name, ms, par in self.phases] }
+
+_startup = _StartupTimer()
+
 #---- dbg_loop
 
 import re, traceback
@@ -75,58 +101,218 @@ if sys.flags.debug:     # when start with: python3 -d application.py
   Timer(8,dbg_loop).start()
 
 
-#---- prepare RELAY_SERVER, APP_NAME
+#---- prepare RELAY_SERVER, APP_NAMES
 
 RELAY_SERVER = os.environ.get('RELAY_SERVER','')
 
-def _auto_locate_dapp():
-  # first find from sys.argv
-  b = sys.argv[1:]; i = len(b) - 1
-  while i >= 0:
-    item = b[i]
-    if item[:1] != '-' and len(item.split()) == 1:
-      return item
-    i -= 1
-  
-  # then random choose one
-  b = os.listdir('.')
+def _is_dapp_dir(item):
+  return item[:1] != '.' and os.path.isfile(os.path.join(item,'dapp_http.py'))  # for every dapp, dapp_http.py must in using
+
+def _auto_locate_dapps():
+  # first find from sys.argv, 'a b' or 'a,b' hosts several dapps in this process
+  b = [item for item in sys.argv[1:] if item[:1] != '-' and len(item.split()) == 1]
+  names = []
   for item in b:
-    if item[:1] == '.': continue
-    if os.path.isfile(os.path.join(item,'dapp_http.py')):
-      return item    # for every dapp, dapp_http.py must in using
+    for name in item.split(','):
+      if name and name not in names: names.append(name)
+  if len(names) > 1:
+    b = [name for name in names if _is_dapp_dir(name)]
+    names = b or names[-1:]
+  if names: return names
+  
+  # then host all when '--all', or random choose one
+  b = sorted(item for item in os.listdir('.') if _is_dapp_dir(item))
+  if b: return b if '--all' in sys.argv else b[:1]
   raise RuntimeError('can not locate dapp root directory')
 
-APP_NAME = _auto_locate_dapp()  # maybe many dapp-dir exists, you need denote one  # python3 dapps.py <dapp_name>
+APP_NAMES = _auto_locate_dapps()  # python3 dapps.py <dapp_name> [<dapp_name2> ...]
+APP_NAME = APP_NAMES[0]           # the first one, name of this process
 
-#---- prepare _lcns_info
+def _phase(name, dist_name):   # name of startup phase, tagged by dapp when hosting several
+  return name if len(APP_NAMES) == 1 else '%s:%s' % (name,dist_name)
 
-from nbcc.dapp_lib.formatter import *
-from nbcc.dapp_lib.lcns_loader import *
+#---- prepare _lcns_info
 
-@compose((
-  ('create_time',NI), ))
-class DappConnBody: pass
+def _load_lcns_info(dist_name):
+  start = time.monotonic()
+  lcns_file = os.path.join(dist_name,'license.dat')
+  if not os.path.isfile(lcns_file): return None
   
-@compose((
-  ('name',VarStr),
-  ('conn_num',NI), ))
-class DappConnAmount: pass
+  from nbcc.dapp_lib.formatter import compose, NI, VarStr   # import when license is used
+  from nbcc.dapp_lib.lcns_loader import load_end_lcns
   
-def _load_lcns_info():
-  lcns_file = os.path.join(APP_NAME,'license.dat')
-  if not os.path.isfile(lcns_file): return None
+  @compose((
+    ('create_time',NI), ))
+  class DappConnBody: pass
+  
+  @compose((
+    ('name',VarStr),
+    ('conn_num',NI), ))
+  class DappConnAmount: pass
   
   with open(lcns_file,'rb') as f:
     info = load_end_lcns(f.read(),DappConnBody,DappConnAmount)
   
-  assert info[3]._._name.decode('utf-8') == APP_NAME
+  assert info[3]._._name.decode('utf-8') == dist_name   # every dapp uses its own license
+  _startup.mark(_phase('license',dist_name),start)
   return info
 
-_lcns_info = _load_lcns_info() if RELAY_SERVER else None  # when connect to tr-client, we try locate license.dat file
+_lcns_futures = {}   # {dist_name: future}, when connect to tr-client, license.dat files are loaded in parallel with imports
+
+#---- file watcher, inotify on linux and polling on other platforms
+
+import struct, select, ctypes, ctypes.util
+from threading import Thread, Lock
+
+class _TailFile:   # incremental reader for appending file, rewritten file will be reloaded
+  def __init__(self, path, callback):
+    self.path = path
+    self.callback = callback   # callback(lines,reset)
+    self.lock = Lock()
+    self.ino = None
+    self.size = 0
+    self.mtime = 0
+    self.partial = b''
+  
+  def check(self):
+    with self.lock:
+      try:
+        st = os.stat(self.path)
+      except OSError:
+        if self.ino is not None:     # file removed
+          self.ino = None; self.size = 0; self.mtime = 0; self.partial = b''
+          self.callback([],True)
+        return
+      
+      reset = self.ino != st.st_ino or st.st_size < self.size
+      if not reset:
+        if st.st_size == self.size:
+          if st.st_mtime == self.mtime: return  # not changed
+          reset = True      # rewritten with same size
+      
+      offset = 0 if reset else self.size
+      with open(self.path,'rb') as f:
+        f.seek(offset)
+        data = f.read()
+      
+      self.ino = st.st_ino; self.mtime = st.st_mtime
+      self.size = offset + len(data)
+      if reset: self.partial = b''
+      
+      lines = (self.partial + data).split(b'\n')
+      self.partial = lines.pop()      # last line maybe not finished
+      lines = [ln.decode('utf-8','replace').strip() for ln in lines]
+      lines = [ln for ln in lines if ln]
+      if lines or reset:
+        try:
+          self.callback(lines,reset)
+        except:
+          logger.warning(traceback.format_exc())
+
+_IN_MODIFY      = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM  = 0x00000040
+_IN_MOVED_TO    = 0x00000080
+_IN_CREATE      = 0x00000100
+_IN_DELETE      = 0x00000200
+_IN_NONBLOCK    = 0x00000800
+_IN_CLOEXEC     = 0x00080000
+
+_IN_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+def _inotify_init():
+  if not sys.platform.startswith('linux'): return (None,-1)
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',use_errno=True)
+    fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if fd >= 0: return (libc,fd)
+  except: pass
+  logger.warning('inotify not available, use polling instead')
+  return (None,-1)
+
+class FileWatcher(Thread):
+  def __init__(self, poll_interval=5):
+    Thread.__init__(self,name='FileWatcher')
+    self.daemon = True
+    self.poll_interval = poll_interval
+    self._active = True
+    self._files = {}   # {path: _TailFile}
+    self._wds = {}     # {wd: dir_path}
+    self._libc, self._fd = _inotify_init()
+  
+  @property
+  def use_inotify(self):
+    return self._fd >= 0
+  
+  def watch(self, path, callback):  # callback(lines,reset) will be called in watcher thread
+    path = os.path.abspath(path)
+    tail = _TailFile(path,callback)
+    
+    if self._fd >= 0:
+      dir_name = os.path.dirname(path)
+      if dir_name not in self._wds.values():
+        wd = self._libc.inotify_add_watch(self._fd,dir_name.encode('utf-8'),_IN_WATCH_MASK)
+        if wd >= 0:
+          self._wds[wd] = dir_name
+        else: logger.warning('inotify watch failed: %s',dir_name)
+    
+    self._files[path] = tail
+    tail.check()       # load existing content at once
+    return tail
+  
+  def check_now(self, path=None):
+    if path:
+      tail = self._files.get(os.path.abspath(path))
+      if tail: tail.check()
+    else:
+      for tail in list(self._files.values()):
+        tail.check()
+  
+  def exit(self):
+    self._active = False
+  
+  def _read_events(self):
+    try:
+      data = os.read(self._fd,8192)
+    except BlockingIOError:
+      return
+    
+    changed = set(); idx = 0; n = len(data)
+    while idx + 16 <= n:
+      wd, mask, cookie, size = struct.unpack_from('iIII',data,idx)
+      name = data[idx+16:idx+16+size].rstrip(b'\0').decode('utf-8','replace')
+      idx += 16 + size
+      
+      dir_name = self._wds.get(wd)
+      if dir_name and name:
+        changed.add(os.path.join(dir_name,name))
+    
+    for path in changed:
+      tail = self._files.get(path)
+      if tail: tail.check()
+  
+  def run(self):
+    while self._active:
+      try:
+        if self._fd >= 0:
+          r, _, _ = select.select([self._fd],[],[],60)
+          if r:
+            self._read_events()
+          else: self.check_now()   # make up missed events, seldom happen
+        else:
+          time.sleep(self.poll_interval)
+          self.check_now()
+      except:
+        logger.warning(traceback.format_exc())
+        time.sleep(self.poll_interval)
+    
+    if self._fd >= 0: os.close(self._fd)
+
+_file_watcher = FileWatcher()
 
 #---- load config file and create FLASK app
 
-import time, json, importlib
+import json, importlib
 
 from nbcc.dapp_lib.dapp_cfg import DappConfig
 
@@ -137,73 +323,182 @@ _rb_var_file = os.path.join(os.path.expanduser('~'),'red-brick','var')
 os.makedirs(_rb_var_file,exist_ok=True)
 _rb_var_file = os.path.join(_rb_var_file,'.nbc_login')
 
-_login_tokens = []
-_login_renew_tm = 0
 _ignore_tee_tok = bool(os.environ.get('IGNORE_TEE_TOK'))
 
-def check_token_ok(request):
-  if _ignore_tee_tok: return 'IGNORED'
+from collections import OrderedDict
+
+class _TokenStore:
+  def __init__(self, life=0, max_num=1024, max_bad=256, bad_life=60, bad_recheck=1):
+    self.life = life          # seconds of token valid after login, 0 for never expired
+    self.max_num = max_num
+    self.max_bad = max_bad
+    self.bad_life = bad_life
+    self.bad_recheck = bad_recheck  # when polling, stat file again for a bad token older than this
+    self.tail = None          # _TailFile of .nbc_login
+    self.evented = False      # tail is notified by inotify, a login clears its bad token at once
+    
+    self._tokens = {}         # {tok: expire_time}, kept in appending order, expire_time is 0 when never expired
+    self._bad = OrderedDict() # {tok: added_time}, negative cache
+    self._lock = Lock()
+    
+    self.hits = 0
+    self.misses = 0
+    self.bad_hits = 0
+    self.reloads = 0
   
-  ret = ''
-  tee_tok = request.cookies.get('_tee_tok_','')
+  def on_lines(self, lines, reset):   # callback of file watcher
+    with self._lock:
+      self.reloads += 1
+      if reset: self._tokens.clear()
+      
+      for line in lines:
+        b2 = line.split(',')
+        if len(b2) == 2:
+          try:
+            expired = int(b2[0]) + self.life if self.life else 0
+          except ValueError: continue
+          tok = b2[1]
+          self._tokens.pop(tok,None)
+          self._tokens[tok] = expired
+          self._bad.pop(tok,None)
+      
+      while len(self._tokens) > self.max_num:
+        self._tokens.pop(next(iter(self._tokens)))
+  
+  def _lookup(self, tok, now):
+    expired = self._tokens.get(tok)
+    if expired is None: return False
+    if not expired or expired > now: return True
+    with self._lock:
+      if self._tokens.get(tok) == expired: del self._tokens[tok]
+    return False
   
-  if tee_tok:
-    for _,tok in _login_tokens:
-      if tok == tee_tok:
-        return tok
+  def check(self, tok):
+    now = time.time()
+    if self._lookup(tok,now):
+      self.hits += 1
+      return True
     
-    global _login_renew_tm
-    now_tm = time.time()
-    if now_tm - _login_renew_tm < 10: return ret  # ignore when just now reloaded
+    self.misses += 1
+    added = self._bad.get(tok)
+    if added and now - added < self.bad_life:
+      if self.evented or now - added < self.bad_recheck:
+        self.bad_hits += 1
+        return False
     
-    try:
-      tmp = []
-      if os.path.isfile(_rb_var_file):
-        b = open(_rb_var_file,'rt').read().splitlines()
-        for line in b:
-          b2 = line.split(',')
-          if len(b2) == 2:
-            tmp.append(b2)
-            if b2[1] == tee_tok:
-              ret = tee_tok
-      
-      _login_tokens[:] = tmp[-16:]  # max hold 16 items
-      _login_renew_tm = now_tm
-    except: pass
+    if self.tail: self.tail.check()   # only stat when file not changed
+    if self._lookup(tok,now):
+      return True
+    
+    with self._lock:
+      self._bad.pop(tok,None)
+      self._bad[tok] = now
+      while len(self._bad) > self.max_bad:
+        self._bad.popitem(last=False)
+    return False
   
-  return ret
+  def stats(self):
+    return { 'tokens': len(self._tokens), 'bad_tokens': len(self._bad), 'hits': self.hits,
+      'misses': self.misses, 'bad_hits': self.bad_hits, 'reloads': self.reloads }
 
-def localhost_main(tcp_port, config, dist_name, inDebug=False):
-  global app
+_token_store = _TokenStore(int(os.environ.get('TEE_TOK_LIFE') or 0))
+
+def check_token_ok(request):
+  if _ignore_tee_tok: return 'IGNORED'
   
+  tee_tok = request.cookies.get('_tee_tok_','')
+  if tee_tok and _token_store.check(tee_tok):
+    return tee_tok
+  return ''
+
+apps = {}   # {dist_name: flask app}
+
+def _import_dapp(dist_name, static_url, inDebug=False):   # return dapp_http module of the dapp
+  global app
   dapp_http = importlib.import_module(dist_name + '.dapp_http')
   static_dir = os.path.abspath(dist_name + '/static')
-  app = dapp_http.config_http(static_dir,static_url='/static')
-  if inDebug: app.debug = True
+  apps[dist_name] = dapp_http.config_http(static_dir,static_url=static_url)
+  if app is None: app = apps[dist_name]
+  if inDebug: apps[dist_name].debug = True
+  _startup.mark(_phase('import flask',dist_name))
+  return dapp_http
+
+def _import_dapp_main(dist_name):
+  # import relayed-flask basic framework
+  logger.info('start import %s.dapp ...',dist_name)
+  local_web = importlib.import_module(dist_name + '.local_web')  # already call dapp_http.config_http()
+  dapp = importlib.import_module(dist_name + '.dapp')
+  _startup.mark(_phase('import dapp',dist_name))
+
+def localhost_main(tcp_port, dist_names, inDebug=False):
+  # all dapps share one listener, one reactor and its thread pool, every dapp is at '/<dist_name>/'
+  if isinstance(dist_names,str): dist_names = [dist_names]
+  
+  # step 1: listen first, connections wait in backlog until reactor runs, then answer 503 until dapp is ready
+  import socket
+  sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+  sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+  sock.bind(('',tcp_port))
+  sock.listen(50)
+  sock.setblocking(False)
+  _startup.mark('listen')
   
   from twisted.internet import reactor
   from twisted.web.resource import Resource
   from twisted.web.server import Site
+  _startup.mark('import twisted')
   
-  os.environ['APP_NAME'] = ''
-  
-  # import relayed-flask basic framework
-  logger.info('start import %s.dapp ...',dist_name)
-  local_web = importlib.import_module(dist_name + '.local_web')  # already call dapp_http.config_http()
-  dapp = importlib.import_module(dist_name + '.dapp')
+  class _Starting(Resource):   # placeholder before dapp loaded, or after loading failed
+    isLeaf = True
+    def __init__(self, failed=False):
+      Resource.__init__(self)
+      self.failed = failed
+    
+    def render(self, request):
+      request.setResponseCode(500 if self.failed else 503)
+      if not self.failed: request.setHeader(b'Retry-After',b'1')
+      request.setHeader(b'Content-Type',b'text/plain')
+      return b'LOAD_FAILED' if self.failed else b'STARTING'
   
   _localhost_res = Resource()
-  _localhost_res.putChild(APP_NAME.encode('utf-8'),dapp_http._flask_site)
+  for dist_name in dist_names:
+    _localhost_res.putChild(dist_name.encode('utf-8'),_Starting())
+  if hasattr(reactor,'adoptStreamPort'):
+    reactor.adoptStreamPort(sock.fileno(),socket.AF_INET,Site(_localhost_res))
+    sock.close()   # reactor has its own copy
+  else:
+    sock.close()
+    reactor.listenTCP(tcp_port,Site(_localhost_res))
+  reactor.getThreadPool()    # create it in main thread
+  for dist_name in dist_names:
+    print('\nstarting web server (http://localhost:%s/%s/) ...' % (tcp_port,dist_name))
+  print('')
   
-  print('\nstarting web server (http://localhost:%s/%s/) ...\n' % (tcp_port,dist_name))
-  reactor.listenTCP(tcp_port,Site(_localhost_res))
+  # step 2: import flask and dapps in background, reactor is running meanwhile
+  def load_dapps():
+    os.environ['APP_NAME'] = ''
+    loaded = 0
+    for dist_name in dist_names:
+      try:
+        dapp_http = _import_dapp(dist_name,'/static',inDebug)
+        _import_dapp_main(dist_name)
+        reactor.callFromThread(_localhost_res.putChild,dist_name.encode('utf-8'),dapp_http._flask_site)
+        loaded += 1
+      except:
+        logger.error('load dapp %s failed: %s',dist_name,traceback.format_exc())
+        reactor.callFromThread(_localhost_res.putChild,dist_name.encode('utf-8'),_Starting(True))
+    
+    if loaded:
+      reactor.callFromThread(_startup.finish)
+    else: reactor.callFromThread(reactor.stop)
+  
+  th = Thread(target=load_dapps,name='DappLoader')
+  th.daemon = True
+  th.start()
   reactor.run()
 
 #----
 
-_route_prefix  = ''
-_old_app_route = None
-
 _vendor_root = os.path.join(os.path.expanduser('~'),'.red-brick')
 os.makedirs(_vendor_root,exist_ok=True)
 
@@ -218,66 +513,98 @@ def _localaccess(dapp):
     except: pass
   return None
 
-def _app_route(*args, **kwarg):
-  prefix = _route_prefix
-  if prefix: prefix = '/' + prefix
-  if args:
-    args = (prefix+args[0],) + args[1:]
-  else: kwarg['rule'] = prefix + kwarg['rule']
-  return _old_app_route(*args,**kwarg)
-
-def root_main(config, relay_serv, dist_name, inDebug=False):
-  global app, _old_app_route, _lcns_info
-  
-  dapp_http = importlib.import_module(dist_name + '.dapp_http')
-  static_dir = os.path.abspath(dist_name + '/static')
-  app = dapp_http.config_http(static_dir,static_url='/'+dist_name+'/static')
-  if inDebug: app.debug = True
+def _prefix_route(app, dist_name):   # app.route('/x') registers '/<dist_name>/x'
+  old_route = app.route   # save bound method
+  prefix = '/' + dist_name
   
-  _old_app_route = app.route   # save bound method
-  app.route = _app_route       # replace old one
+  def route(*args, **kwarg):
+    if args:
+      args = (prefix+args[0],) + args[1:]
+    else: kwarg['rule'] = prefix + kwarg['rule']
+    return old_route(*args,**kwarg)
+  app.route = route       # replace old one
+
+def root_main(relay_serv, dist_names, inDebug=False):
+  # every dapp has its own relay connections that authorized by its license, they share one reactor
+  if isinstance(dist_names,str): dist_names = [dist_names]
   
-  b = relay_serv.rsplit(':',maxsplit=1)
-  if _lcns_info:
-    dapp_http.start_web_service((b[0],int(b[1])),_lcns_info)
-    _lcns_info = None
-  else:   # try start in localaccess mode
-    conn_num = _localaccess(dist_name) or 2   # default connection num is 2
-    dapp_http.start_web_service((b[0],int(b[1])),None,conn_num,dist_name)
+  relays = []   # relay_serv can be 'host:port,host2:port2', connections are spread over them
+  for item in relay_serv.split(','):
+    b = item.strip().rsplit(':',maxsplit=1)
+    if len(b) == 2: relays.append((b[0],int(b[1])))
   
-  logger.info('start import %s.dapp ...',dist_name)
-  local_web = importlib.import_module(dist_name + '.local_web') # already call dapp_http.config_http()
-  dapp = importlib.import_module(dist_name + '.dapp')
+  os.environ['APP_NAME'] = ''
+  loaded = []
+  for dist_name in dist_names:
+    try:
+      dapp_http = _import_dapp(dist_name,'/'+dist_name+'/static',inDebug)
+      _prefix_route(apps[dist_name],dist_name)
+      
+      lcns_info = _lcns_futures[dist_name].result()   # raise error when license is invalid
+      _startup.mark(_phase('wait license',dist_name))
+      if lcns_info:
+        dapp_http.start_web_service(relays,lcns_info)
+      else:   # try start in localaccess mode
+        conn_num = _localaccess(dist_name) or 2   # default connection num is 2
+        dapp_http.start_web_service(relays,None,conn_num,dist_name)
+      
+      _import_dapp_main(dist_name)
+      loaded.append(dist_name)
+    except:
+      if len(dist_names) == 1: raise
+      logger.error('load dapp %s failed: %s',dist_name,traceback.format_exc())
+  if not loaded: raise RuntimeError('no dapp loaded')
   
-  print('\nconnect to tr-client (%s:%s)\n' % (b[0],b[1]))
+  print('\nconnect to tr-client (%s) for %s\n' % (', '.join('%s:%s' % b for b in relays),', '.join(loaded)))
   from twisted.internet import reactor
+  reactor.callWhenRunning(_startup.finish)
   reactor.run()     # holding here
 
 
 if __name__ == '__main__':
-  assert APP_NAME
-  runtime = importlib.import_module(APP_NAME).runtime
-  runtime['APP_NAME'] = APP_NAME
-  runtime['check_token_ok'] = check_token_ok
+  assert APP_NAMES
+  if RELAY_SERVER:
+    from concurrent.futures import ThreadPoolExecutor
+    _lcns_pool = ThreadPoolExecutor(1,'LcnsLoader')
+    for name in APP_NAMES:
+      _lcns_futures[name] = _lcns_pool.submit(_load_lcns_info,name)
+  
+  _token_store.tail = _file_watcher.watch(_rb_var_file,_token_store.on_lines)
+  _token_store.evented = _file_watcher.use_inotify
+  _file_watcher.start()
   
-  config = DappConfig.load(APP_NAME,False,os.path.join(APP_NAME,'config.json'))
-  runtime['config'] = config
+  lsn_port = os.environ.get('LISTEN_PORT','8000')
+  for name in APP_NAMES:   # every dapp has its own runtime and config.json
+    runtime = importlib.import_module(name).runtime
+    runtime['APP_NAME'] = name
+    runtime['check_token_ok'] = check_token_ok
+    runtime['token_stats'] = _token_store.stats
+    runtime['watch_file'] = _file_watcher.watch
+    runtime['startup_report'] = _startup.report
+    runtime['config_file'] = cfg_file = os.path.abspath(os.path.join(name,'config.json'))
+    runtime['config'] = DappConfig.load(name,False,cfg_file)
+    if not RELAY_SERVER: runtime['LISTEN_PORT'] = lsn_port
+  
+  runtime = importlib.import_module(APP_NAME).runtime
   inDebug = bool(sys.flags.debug and sys.flags.interactive)
+  _startup.mark('prepare')
   
   if RELAY_SERVER:  # connect to tr-client
-    _route_prefix = APP_NAME
-    root_main(config,RELAY_SERVER,APP_NAME,inDebug)
+    root_main(RELAY_SERVER,APP_NAMES,inDebug)
   
   else:   # listen at local machine
-    runtime['LISTEN_PORT'] = lsn_port = os.environ.get('LISTEN_PORT','8000')
-    localhost_main(int(lsn_port),config,APP_NAME,inDebug)
+    localhost_main(int(lsn_port),APP_NAMES,inDebug)
 
 
 # Usage:
 #   python3 -i -d -u dapps.py sample
 # Or, without debugging:
 #   python3 -u dapps.py sample
+# Host several dapps in one process, they share the reactor and its thread pool:
+#   python3 -u dapps.py sample sample2     # or: dapps.py sample,sample2  or: dapps.py --all
 # Environment:
 #   LISTEN_PORT=8000             # start local http server when RELAY_SERVER is empty, default is 8000
 #   RELAY_SERVER=localhost:8001  # relay by tr-client that suggest using 8001 port, default RELAY_SERVER is empty
+#                                # or a list for failover: RELAY_SERVER=host1:8001,host2:8001
 #   IGNORE_TEE_TOK=1             # cookie-var '_tee_tok_' pseudo checking
+#   TEE_TOK_LIFE=14400           # seconds of '_tee_tok_' valid after login, default is never expired
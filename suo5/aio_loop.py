@@ -0,0 +1,46 @@
+# aio_loop.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import asyncio
+from threading import Thread, Lock, current_thread
+
+_loop = None
+_loop_thread = None
+_loop_lock = Lock()
+
+def _run_loop(loop):
+  asyncio.set_event_loop(loop)
+  try:
+    loop.run_forever()
+  finally:
+    logger.info('asyncio loop exited')
+
+def get_loop():
+  global _loop, _loop_thread
+  with _loop_lock:
+    if _loop is None:
+      _loop = asyncio.new_event_loop()
+      _loop_thread = Thread(target=_run_loop,args=(_loop,),name='AioLoop')
+      _loop_thread.daemon = True
+      _loop_thread.start()
+  return _loop
+
+def in_loop_thread():
+  return _loop_thread is not None and current_thread() is _loop_thread
+
+def run_async(coro):   # schedule coroutine at the shared loop, return concurrent.futures.Future
+  return asyncio.run_coroutine_threadsafe(coro,get_loop())
+
+def run_sync(coro, timeout=None):  # wait result from a non-loop thread
+  assert not in_loop_thread(), 'run_sync() can not be called in loop thread'
+  fut = run_async(coro)
+  try:
+    return fut.result(timeout)
+  except:
+    fut.cancel()
+    raise
+
+def call_soon(fn, *args):
+  return get_loop().call_soon_threadsafe(fn,*args)
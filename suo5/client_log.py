@@ -0,0 +1,178 @@
+# client_log.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os, re, time, traceback
+from collections import deque
+from threading import Thread, Condition, Lock
+
+# suo5 client logs like '[INFO] 2024/01/02 15:04 new connection from 127.0.0.1:53034 to www.example.com:443'
+_LEVEL = re.compile(r'\[(DBUG|DEBU|DEBUG|INFO|WARN|WARNING|ERRO|ERROR|FTAL|FATAL)\]',re.I)
+_ADDR = re.compile(r'((?:\[[0-9a-fA-F:]+\])|(?:[A-Za-z0-9](?:[A-Za-z0-9\-.]*[A-Za-z0-9])?)):(\d{1,5})\b')
+_BYTES = re.compile(r'(\d+)\s*bytes',re.I)
+_ELAPSED = re.compile(r'\b(?:took|cost|elapsed|latency|in|after)\s*[:=]?\s*(\d+(?:\.\d+)?)\s*(ms|s)\b',re.I)
+
+_LEVELS = {'dbug':'debug','debu':'debug','erro':'error','ftal':'fatal','warning':'warn'}
+
+# (kind, keywords), the first matched one wins, keywords are lower case
+_KINDS = (
+  ('error', ('error','failed','fail to','timeout','refused','reset by peer','broken pipe','unreachable')),
+  ('close', ('closed','close connection','disconnect')),
+  ('ready', ('connected to','handshake success','established','dial success')),
+  ('open', ('new connection','start dial','dialing','connecting to','connect to')) )
+
+def _target(text):   # remote host:port in the line, prefer the one after ' to '
+  best = ''
+  for m in _ADDR.finditer(text):
+    if m.group(1).isdigit(): continue   # time such as 15:04
+    before = text[max(0,m.start() - 5):m.start()].lower()
+    if before == 'from ': continue      # peer of the connection
+    addr = '%s:%s' % (m.group(1),m.group(2))
+    if before[1:] == ' to ': return addr
+    if not best: best = addr
+  return best
+
+def parse_line(text):   # return (level,kind,target,bytes,elapsed_ms) of a line from suo5 client
+  m = _LEVEL.search(text)
+  level = m.group(1).lower() if m else ''
+  level = _LEVELS.get(level,level)
+  low = text.lower()
+
+  kind = 'log'
+  if level in ('error','fatal'):
+    kind = 'error'
+  else:
+    for name, words in _KINDS:
+      if any(w in low for w in words):
+        kind = name
+        break
+
+  m = _BYTES.search(text)
+  nbytes = int(m.group(1)) if m else 0
+  m = _ELAPSED.search(text)
+  elapsed = (float(m.group(1)) * (1 if m.group(2).lower() == 'ms' else 1000)) if m else None
+  return (level,kind,_target(text),nbytes,elapsed)
+
+class LogWriter(Thread):   # batch lines in memory, append to size-capped rotated files
+  def __init__(self, path, max_bytes=1024*1024, backups=3, flush_interval=5, flush_bytes=64*1024):
+    Thread.__init__(self,name='LogWriter')
+    self.daemon = True
+    self.path = path
+    self.max_bytes = max_bytes
+    self.backups = backups
+    self.flush_interval = flush_interval
+    self.flush_bytes = flush_bytes
+    self.writes = 0        # number of batched writes
+    self.rotations = 0
+
+    self._buf = []
+    self._buf_size = 0
+    self._active = True
+    self._cond = Condition()
+    self._file_lock = Lock()
+    try:
+      self._size = os.path.getsize(path)
+    except OSError:
+      self._size = 0
+
+  def write(self, line):   # line is bytes ends with b'\n'
+    with self._cond:
+      self._buf.append(line)
+      self._buf_size += len(line)
+      if self._buf_size >= self.flush_bytes: self._cond.notify()
+
+  def _rotate(self):
+    for i in range(self.backups - 1,0,-1):
+      src = '%s.%i' % (self.path,i)
+      if os.path.exists(src): os.replace(src,'%s.%i' % (self.path,i + 1))
+    if self.backups > 0:
+      os.replace(self.path,self.path + '.1')
+    else: os.remove(self.path)
+    self._size = 0
+    self.rotations += 1
+
+  def flush(self):
+    with self._cond:
+      lines = self._buf
+      self._buf = []
+      self._buf_size = 0
+    if not lines: return
+
+    data = b''.join(lines)
+    with self._file_lock:
+      try:
+        if self._size and self._size + len(data) > self.max_bytes: self._rotate()
+        with open(self.path,'ab') as f:
+          f.write(data)
+        self._size += len(data)
+        self.writes += 1
+      except OSError as e:
+        logger.warning('write %s failed: %s',self.path,e)
+
+  def run(self):
+    while True:
+      with self._cond:
+        if self._active and self._buf_size < self.flush_bytes:
+          self._cond.wait(self.flush_interval)
+        active = self._active
+      self.flush()
+      if not active: break
+
+  def exit(self):
+    with self._cond:
+      self._active = False
+      self._cond.notify()
+
+class ClientLog:   # output of suo5 clients: parsed events in a ring buffer, raw lines in rotated files
+  def __init__(self, path, ring_size=1000, **writer_args):
+    self.ring = deque(maxlen=ring_size)
+    self.seq = 0
+    self.lines = 0
+    self.counts = {}     # {kind: number}
+    self.listeners = []  # fn(event) called for every event, in reader threads
+    self.writer = LogWriter(path,**writer_args) if path else None
+    self._lock = Lock()
+
+  def start(self):
+    if self.writer: self.writer.start()
+
+  def exit(self):
+    if self.writer:
+      self.writer.exit()
+      self.writer.flush()
+
+  def feed(self, backend, stream, line):   # called in pipe reader threads, line is bytes
+    text = line.decode('utf-8','replace').rstrip()
+    if not text: return
+    now = time.time()
+    level, kind, target, nbytes, elapsed = parse_line(text)
+
+    with self._lock:
+      self.seq += 1
+      self.lines += 1
+      self.counts[kind] = self.counts.get(kind,0) + 1
+      event = { 'seq': self.seq, 'time': round(now,3), 'backend': backend, 'stream': stream,
+        'level': level, 'kind': kind, 'target': target, 'bytes': nbytes, 'ms': elapsed, 'text': text }
+      self.ring.append(event)
+
+    if self.writer:
+      stamp = time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(now))
+      self.writer.write(('%s %s %s %s\n' % (stamp,backend,stream,text)).encode('utf-8'))
+    for fn in self.listeners:
+      try:
+        fn(event)
+      except:
+        logger.warning(traceback.format_exc())
+
+  def events(self, since=0, limit=200, backend='', kind=''):   # newest events after seq 'since'
+    with self._lock:
+      items = [e for e in self.ring if e['seq'] > since and (not backend or e['backend'] == backend)
+        and (not kind or e['kind'] == kind)]
+    return items[-limit:] if limit else items
+
+  def stats(self):
+    ret = {'lines': self.lines, 'seq': self.seq, 'buffered': len(self.ring), 'kinds': dict(self.counts)}
+    if self.writer:
+      ret.update(file=self.writer.path,writes=self.writer.writes,rotations=self.writer.rotations)
+    return ret
@@ -0,0 +1,128 @@
+# config_store.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os, json, copy, hashlib, traceback
+from threading import Lock, Timer
+
+def diff_keys(old, new, prefix=''):   # changed keys, nested dicts are compared by item, such as 'ex_opt.user_agent'
+  ret = []
+  for k in sorted(set(old) | set(new),key=str):
+    a = old.get(k); b = new.get(k)
+    if a == b: continue
+    if isinstance(a,dict) and isinstance(b,dict):
+      ret.extend(diff_keys(a,b,prefix + str(k) + '.'))
+    else: ret.append(prefix + str(k))
+  return ret
+
+def _dump(cfg):   # indent 2, same as config.json shipped with dapp
+  return json.dumps(dict(cfg),indent=2).encode('utf-8')
+
+class ConfigStore:   # config.json of dapp: coalesced saves, edits on disk are diffed and dispatched
+  def __init__(self, cfg, path, delay=1):
+    self.cfg = cfg        # dict-like config shared by the dapp, such as DappConfig
+    self.path = path
+    self.delay = delay    # seconds to coalesce saves
+    self.listeners = []   # fn(old,changed) called in file watcher thread after config.json edited
+    self.requests = 0     # number of save() calls
+    self.writes = 0       # number of real writes
+    self.reloads = 0
+    self._timer = None
+    self._lock = Lock()
+    self._saved = hashlib.sha256(_dump(cfg)).digest()   # content in memory when last saved or loaded
+    try:
+      with open(path,'rb') as f:
+        self._digest = hashlib.sha256(f.read()).digest()   # content of file written or read by us
+    except OSError:
+      self._digest = None
+
+  def update(self, new_items):   # change config in memory and save later, return changed keys
+    with self._lock:   # not mixed with reloading or a save in progress
+      old = {k: copy.deepcopy(self.cfg.get(k)) for k in new_items}
+      self.cfg.update(new_items)
+    changed = diff_keys(old,new_items)
+    if changed: self.save()
+    return changed
+
+  def save(self):   # write later, a burst of saves costs one write
+    with self._lock:
+      self.requests += 1
+      if self._timer is None:
+        self._timer = Timer(self.delay,self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+  def flush(self):   # write at once when content changed
+    with self._lock:   # also blocks on_file(), so a half written file is never read as an edit
+      if self._timer:
+        self._timer.cancel()
+        self._timer = None
+      data = _dump(self.cfg)
+      saved = hashlib.sha256(data).digest()
+      if saved == self._saved: return False
+
+      tmp = self.path + '.tmp'   # not DappConfig.save(), it rewrites in place: tmp, fsync, rename
+      try:
+        with open(tmp,'wb') as f:
+          f.write(data)
+          f.flush()
+          os.fsync(f.fileno())
+        os.replace(tmp,self.path)
+        self._digest = saved
+        self._saved = saved
+        self.writes += 1
+      except OSError as e:
+        logger.warning('save %s failed: %s',self.path,e)
+        return False
+
+    try:   # make the rename durable
+      fd = os.open(os.path.dirname(os.path.abspath(self.path)),os.O_RDONLY)
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+    except OSError: pass
+    return True
+
+  def on_file(self, lines, reset):   # callback of runtime['watch_file'], only used as notification
+    with self._lock:
+      try:
+        with open(self.path,'rb') as f:
+          data = f.read()
+      except OSError:
+        return
+      if not data.strip(): return   # truncated by editor, content comes later
+      digest = hashlib.sha256(data).digest()
+      if digest == self._digest: return   # written by us, or not changed
+
+    try:
+      new = json.loads(data.decode('utf-8'))
+      if not isinstance(new,dict): raise ValueError('not a json object')
+    except ValueError as e:
+      logger.warning('ignore invalid %s: %s',self.path,e)   # maybe half written, wait next change
+      return
+
+    with self._lock:
+      if self._timer:   # edit on disk wins over pending save
+        self._timer.cancel()
+        self._timer = None
+      self._digest = digest
+      old = copy.deepcopy(dict(self.cfg))
+      changed = diff_keys(old,new)
+      for k in [k for k in self.cfg if k not in new]:
+        del self.cfg[k]
+      self.cfg.update(new)
+      self._saved = hashlib.sha256(_dump(self.cfg)).digest()
+      if changed: self.reloads += 1
+
+    if not changed: return
+    logger.info('config.json changed: %s',', '.join(changed))
+    for fn in self.listeners:
+      try:
+        fn(old,changed)
+      except:
+        logger.warning(traceback.format_exc())
+
+  def stats(self):
+    return {'requests': self.requests, 'writes': self.writes, 'reloads': self.reloads, 'pending': self._timer is not None}
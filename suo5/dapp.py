@@ -3,10 +3,23 @@
 import logging
 logger = logging.getLogger(__name__)
 
-import os, time, struct, base64, json, traceback
-from threading import Thread, Timer
+import os, socket, base64, platform, traceback
+from threading import BoundedSemaphore
 from binascii import unhexlify
-from urllib.request import urlopen
+
+from .aio_loop import run_sync
+from .prober import Suo5Prober
+from .scheduler import Scheduler
+from .tunnel import Suo5Tunnel
+from .metrics import ProbeStats, render_prometheus
+from .events import EventHub, sse_render
+from .jobs import JobQueue
+from .discovery import ServerDiscovery
+from .upstream import UpstreamPool, parse_urls
+from .client_log import ClientLog
+from .diagnosis import ConnTracker
+from .config_store import ConfigStore
+from .tuner import Tuner, TUNE_OPTIONS
 
 #----
 
@@ -14,7 +27,8 @@ _last_cred = ''       # current in using credential
 _newest_cred = ''     # newest credential when it re-applied
 _relay_server = None  # suo5 server: (ip:port)
 
-suo5_server_url  = ''  # https://.../stream
+suo5_server_url  = ''  # https://.../stream, the upstream in using
+suo5_server_urls = []  # all configured upstreams
 suo5_server_ip   = ''
 suo5_server_port = 8000
 
@@ -35,13 +49,12 @@ def when_cred_updated(now_tm, keycode, relay_server):
     
     if auto_start_suo5 and is_server_cfg_ok():
       _relay_server = (relay_server[0],suo5_server_port)
+      _notify_state('credential')
       if not _last_cred:
-        pid_str = find_suo5_PID()
-        if pid_str:
-          os.popen('kill -9 ' + pid_str).read()   # ensure only one suo5 client in running
-          logger.info('old suo5 client is killed.')
-        Timer(1,start_suo5_client).start()
-      else: check_alive.check_right_now = True
+        jobs.submit('start',start_suo5_client)
+      elif _newest_cred != _last_cred and ex_opt.get('user_agent') == FIXED_SUO5_UA:
+        jobs.submit('start',start_suo5_client)   # rotate to new client that using newest credential
+      else: check_alive.check_right_now()
   except: pass
 
 #----
@@ -49,9 +62,13 @@ def when_cred_updated(now_tm, keycode, relay_server):
 from . import runtime
 
 _check_token_ok = runtime['check_token_ok']
+_token_stats = runtime.get('token_stats',dict)
 
 auto_start_suo5 = bool(runtime['config'].get('auto_start_suo5',False))
 
+config_store = ConfigStore(runtime['config'],runtime.get('config_file') or
+  os.path.join(os.path.dirname(os.path.abspath(__file__)),'config.json'))
+
 suo5_local_host = ''  # 0.0.0.0:49000
 find_client_pid = ''  # ps -ef | grep 'suo5/suo5-' | grep -v grep | awk '{print $2}'
 client_user_psw = ''  # 'user:password' or ''
@@ -63,25 +80,35 @@ _suo5_bin_list = {
   ('linux','x86_64'): 'suo5-linux-amd64',    # linux x86
   ('linux','aarch64'): 'suo5-linux-arm64' }  # linux arm
 suo5_bin = None
+_suo5_bin_dir = os.path.dirname(os.path.abspath(__file__))
+
+def _auto_restart():   # called when suo5 client exits unexpectedly
+  if auto_start_suo5 and is_server_cfg_ok() and _newest_cred:
+    start_suo5_client()
 
 def init_suo5():
   global suo5_bin
-  global auto_start_suo5, suo5_server_url
-  global suo5_local_host, find_client_pid, client_user_psw, ex_opt
+  global auto_start_suo5, suo5_server_url, suo5_server_urls
+  global suo5_local_host, find_client_pid, client_user_psw, ex_opt, client_log
   
-  uname = os.popen('uname -sm').read()  # 'Darwin x86_64' 'Linux aarch64' 'Linux x86_64'
-  uname = tuple(uname.lower().split())
+  uname = (platform.system().lower(),platform.machine().lower())  # ('darwin','x86_64') ('linux','aarch64') ('linux','x86_64')
   suo5_bin = _suo5_bin_list.get(uname,None)
   if suo5_bin is None:
     logger.error('suo5 client not support platform: %s',uname)
     return False
   
   cfg = runtime['config']
-  suo5_server_url = cfg.get('suo5_server_url','')
+  suo5_server_urls = parse_urls(cfg.get('suo5_server_url',''))
+  upstreams.config(suo5_server_urls)
+  upstreams.fail_limit = cfg.get('schedule',{}).get('failover_after',2)
+  if suo5_server_urls:
+    upstreams.use(upstreams.upstreams[0])
+    suo5_server_url = suo5_server_urls[0]
   suo5_local_host = cfg.get('suo5_local_host','')
   find_client_pid = cfg.get('find_client_pid','')
   client_user_psw = cfg.get('client_user_psw','')
   ex_opt = cfg.get('ex_opt',{})
+  _load_serv_ip()
   
   if not suo5_local_host or len(suo5_local_host.split(':')) != 2:
     logger.error('invalid "suo5_local_host" in config.json')
@@ -96,210 +123,380 @@ def init_suo5():
     auto_start_suo5 = False  # meet error, avoid auto start
     return False
   
+  try:
+    log_cfg = cfg.get('client_log',{})
+    client_log = ClientLog(os.path.join(_rb_log_root,'suo5.log'),log_cfg.get('ring_size',1000),
+      max_bytes=log_cfg.get('max_kb',1024) * 1024,backups=log_cfg.get('backups',3),flush_interval=log_cfg.get('flush',5))
+    client_log.listeners.append(conn_tracker.on_event)
+    client_log.start()
+    
+    tunnel.restart_fn = _auto_restart
+    tunnel.on_change = _on_tunnel_change
+    tunnel.setup(suo5_local_host,find_client_pid,cfg.get('drain_timeout',60),cfg.get('backend_num',1),
+      client_log.feed)
+  except:
+    logger.error('setup suo5 tunnel failed: %s',traceback.format_exc())
+    auto_start_suo5 = False  # meet error, avoid auto start
+    return False
+  
   import atexit
+  check_alive.config(cfg.get('schedule',{}))
   check_alive.start()
+  runtime['watch_file'](_tr_login_file,_on_tr_login)
+  config_store.listeners.append(lambda old, changed: _reconfigure(changed))
+  runtime['watch_file'](config_store.path,config_store.on_file)
   atexit.register(lambda: check_alive.exit())
+  atexit.register(lambda: config_store.flush())
+  atexit.register(lambda: client_log.exit())
   
   logger.info('load config successful: suo5=%s, auto=%s, check_alive=%s',suo5_bin,auto_start_suo5,not ex_opt.get('disable_check',False))
   return True
 
+tunnel = Suo5Tunnel('suo5/suo5-')
+client_log = ClientLog(None)   # replaced in init_suo5()
+conn_tracker = ConnTracker()
+jobs = JobQueue(workers=2)
+_restart_limit = BoundedSemaphore(1)   # max number of starting or rotating at the same time
+
 def find_suo5_PID():
-  return os.popen(find_client_pid).read()
+  pid = tunnel.pid
+  return str(pid) if pid else ''
+
+def stop_suo5_client():
+  return tunnel.stop()
 
 FIXED_SUO5_UA = 'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.1.2.3'
 
-def try_init_serv_ip():
+discovery = ServerDiscovery(os.path.join(_rb_var_root,'.suo5_server'))
+
+def _load_serv_ip():   # use last known (ip,port), so starting never waits on discovery
+  global suo5_server_ip, suo5_server_port
+  suo5_server_ip = ''
+  server = discovery.load(suo5_server_url)
+  if server: suo5_server_ip, suo5_server_port = server
+
+upstreams = UpstreamPool()
+
+def _use_upstream(upstream):   # switch suo5_server_url, caller restarts suo5 client
+  global suo5_server_url
+  upstreams.use(upstream)
+  if upstream.url != suo5_server_url:
+    logger.info('use suo5 upstream: %s',upstream.url)
+    suo5_server_url = upstream.url
+    _load_serv_ip()
+    check_alive.trigger('discover')
+    _notify_state('upstream')
+
+def measure_upstreams():   # run as 'upstreams' task of CheckAlive
+  upstreams.sample_traffic(sum(bk.bytes_up + bk.bytes_down for bk in tunnel.backends))
+  if len(upstreams.upstreams) < 2: return
+  try:
+    run_sync(upstreams.measure(ex_opt.get('user_agent','')),timeout=upstreams.timeout * 2 + 5)
+  except:
+    logger.warning(traceback.format_exc())
+
+def try_init_serv_ip():   # blocking, run as 'discover' task of CheckAlive
   global suo5_server_ip, suo5_server_port
-  if suo5_server_ip or not suo5_server_url: return
+  if not suo5_server_url or ex_opt.get('with_get_method',False): return
+  
+  server = discovery.query(suo5_server_url)
+  if server is None: return False
+  if server != (suo5_server_ip,suo5_server_port):
+    suo5_server_ip, suo5_server_port = server
+    check_alive.trigger('tr_login')   # choose login line of this server
+    _notify_state('discovery')
+
+def _suo5_args(listen_host, cred, opt=None):   # opt overrides items of ex_opt, used by tuner
+  opt = dict(ex_opt,**opt) if opt else ex_opt
+  ua = opt.get('user_agent')
+  if ua == FIXED_SUO5_UA: ua = '%s %s' % (ua,cred)
+  
+  args = [os.path.join(_suo5_bin_dir,suo5_bin),'-t',suo5_server_url,'-l',listen_host,'--ua',ua]
+  if client_user_psw:
+    args.extend(('--auth',client_user_psw))
+  if opt.get('with_get_method',False):
+    args.extend(('--method','GET'))
+  if opt.get('with_no_gzip',False):
+    args.append('--no-gzip')
+  if opt.get('with_cookiejar',False):
+    args.append('--jar')
+  return args
+
+_probe_stats = ProbeStats()
+_bk_probers = {}    # {backend_name: Suo5Prober}
+
+def _check_backend(bk, cred):
+  if ex_opt.get('disable_check',False): return True
   
-  if not ex_opt.get('with_get_method',False):  # use POST method
-    try:
-      b = urlopen(suo5_server_url,timeout=10).read()[:64].split(b',')
-      if len(b) >= 3 and b[0] == b'OK':
-        suo5_server_port = int(b[2])
-        suo5_server_ip = b[1].decode('utf-8')
-    except: pass
+  prober = _bk_probers.get(bk.name)
+  if prober is None:
+    prober = _bk_probers[bk.name] = Suo5Prober(stats=_probe_stats)
+  prober.config('%s:%i' % bk.addr,suo5_server_url,client_user_psw)
+  user_agent = '%s %s' % (ex_opt.get('user_agent'),cred)
+  try:
+    return run_sync(prober.probe(user_agent),timeout=prober.timeout*3+10)
+  except:
+    logger.warning(traceback.format_exc())
+  return False
 
-def start_suo5_client():
+def start_suo5_client(force=False):  # start suo5 client, or rotate to new one when it is running
   global _last_cred
   
   if not suo5_server_url: return False
-  if not suo5_server_ip: try_init_serv_ip()
   
-  ua = ex_opt.get('user_agent')
-  if ua != FIXED_SUO5_UA:
-    ex_arg = "--ua '%s' " % (ua,)
-  else: ex_arg = "--ua '%s %s' " % (ua,_newest_cred)
+  with _restart_limit:
+    if not tunnel.running and len(upstreams.upstreams) > 1:
+      best = upstreams.best()   # start against the best one, rotating keeps current one
+      if best: _use_upstream(best)
+    if not suo5_server_ip: check_alive.trigger('discover')
+    
+    cred = _newest_cred
+    for i in range(2):    # try 2 times
+      if tunnel.start(lambda host: _suo5_args(host,cred),lambda bk: _check_backend(bk,cred),force):
+        _last_cred = cred
+        logger.info('suo5 client is starting, pid=%s',tunnel.pid)
+        return True
+      if tunnel.running: break   # rotating failed, keep old one
+    return False
+
+_prober = Suo5Prober(stats=_probe_stats)
+tuner = Tuner('suo5/suo5-')
+
+def run_tune(target_url, options, rounds, max_bytes, apply):   # run as 'tune' job
+  cred = _newest_cred
+  ret = tuner.run(lambda host, opt: _suo5_args(host,cred,opt),target_url,client_user_psw,options,rounds,max_bytes)
+  if ret is None: return False   # another tuning is running
   
-  if client_user_psw:
-    ex_arg += "--auth '%s' " % (client_user_psw,)
-  if ex_opt.get('with_get_method',False):
-    ex_arg += '--method GET '
-  if ex_opt.get('with_no_gzip',False):
-    ex_arg += '--no-gzip '
-  if ex_opt.get('with_cookiejar',False):
-    ex_arg += '--jar '
-  
-  log_file = os.path.join(_rb_log_root,'suo5.out')
-  sh_cmd = "nohup ./suo5/%s -t %s -l %s %s 2>&1 >%s &" % (suo5_bin,suo5_server_url,suo5_local_host,ex_arg,log_file)
-  for i in range(2):    # try 2 times
-    os.popen(sh_cmd).read()
-    time.sleep(2)
-    if find_suo5_PID():
-      _last_cred = _newest_cred
-      logger.info('suo5 client is starting ...')
-      return True
-  return False
+  winner = ret.get('winner')
+  if apply and winner:
+    cfg = runtime['config']
+    ret['applied'] = changed = config_store.update({'ex_opt': dict(cfg.get('ex_opt',{}),**winner)})
+    _reconfigure(changed)
+  _notify_state('tune')
+  return winner is not None
+
+def _on_tunnel_change(reason):
+  if reason == 'rotation':
+    _prober.reset()   # front proxy binds a connection to one backend, keeping it would probe the draining group
+  _notify_state(reason)
 
 def check_suo5_alive():
   if not _last_cred: return False
   if ex_opt.get('disable_check',False): return True  # avoid alive check, take as aliving
   
-  user_agent = ex_opt.get('user_agent')
-  if client_user_psw:
-    auth_arg = '-U %s ' % (client_user_psw,)
-  else: auth_arg = ''
-  sh_cmd = 'curl -s %s--max-time 10 -H "User-Agent: %s %s" -x socks5h://%s %s' % (auth_arg,user_agent,_last_cred,suo5_local_host,suo5_server_url)
-  
+  _prober.config(suo5_local_host,suo5_server_url,client_user_psw)
+  user_agent = '%s %s' % (ex_opt.get('user_agent'),_last_cred)
   try:
-    for i in range(3):    # max try 3 times
-      if os.popen(sh_cmd).read()[:2] == 'OK':
-        return True
-      time.sleep(2)
-  except: pass
+    return run_sync(_prober.probe(user_agent),timeout=_prober.timeout*3+10)  # max try 3 times
+  except:
+    logger.warning(traceback.format_exc())
   return False
 
-'''
-from python_socks import ProxyTimeoutError
-from python_socks.sync import Proxy
+_tr_login_file = os.path.join(_rb_var_root,'.tr_login')
+_tr_login_index = {}    # {server_ip: [now,keycode,server_ip,server_port]}
+_tr_login_last = None   # last appended item
 
-def check_suo5_alive():
-  if not _relay_server: return False
-  if not _last_cred: return False
-  if ex_opt.get('disable_check',False): return True  # avoid alive check, take as aliving
+def _on_tr_login(lines, reset):   # called in file watcher thread
+  global _tr_login_last
+  if reset:
+    _tr_login_index.clear()
+    _tr_login_last = None
   
-  user_agent = ex_opt.get('user_agent')
-  data = 'GET / HTTP/1.1\r\nConnection: close\r\nUser-Agent: %s %s\r\n\r\n' % (user_agent,_last_cred)
-  data = data.encode('utf-8')
-  
-  for i in range(3):  # max try 3 times
-    try:
-      proxy = Proxy.from_url('socks5://' + suo5_local_host)
-      sock = proxy.connect(dest_host=_relay_server[0],dest_port=_relay_server[1],timeout=10)
-      sock.sendall(data)
-      s = sock.recv(4096)
-      idx = s.find(b'\r\n\r\n')
-      if idx > 0 and s[idx+4:idx+6] == b'OK':
-        return True
-    except ProxyTimeoutError:
-      pass    # will try again
-    except:
-      # logger.warning(traceback.format_exc())
-      time.sleep(2)
-      break
+  for line in lines:
+    b2 = line.split(',')
+    if len(b2) == 4:  # should be: "now,keycode,server_ip,server_port"
+      _tr_login_index[b2[2]] = _tr_login_last = b2
   
-  return False  '''
+  if lines: check_alive.trigger('tr_login')
 
-class CheckAlive(Thread):
+class CheckAlive(Scheduler):
   def __init__(self):
-    Thread.__init__(self)
-    self._active = True
-    self.daemon = True
-    self.check_right_now = False
-  
-  def exit(self):
-    self._active = False
-    if self.is_alive():
-      self.join()
-  
-  def run(self):
-    tr_login_file = os.path.join(_rb_var_root,'.tr_login')
-    tr_login_time = 0
+    Scheduler.__init__(self,'CheckAlive')
+    self._tr_login_applied = None
+  
+  def config(self, sched_cfg):
+    retry_min = sched_cfg.get('retry_min',10); retry_max = sched_cfg.get('retry_max',300)
+    if 'probe' in self._tasks:   # reconfig after config.json changed
+      self.set_interval('discover',sched_cfg.get('discover',1800),retry_min,retry_max)
+      self.set_interval('upstreams',sched_cfg.get('upstreams',300))
+      self.set_interval('probe',sched_cfg.get('probe',60),retry_min,retry_max)
+      if 'backends' in self._tasks:
+        self.set_interval('backends',sched_cfg.get('backends',30))
+    else:
+      self.add_task('tr_login',self.check_login,None)   # triggered by watching .tr_login
+      self.add_task('discover',try_init_serv_ip,sched_cfg.get('discover',1800),
+        first_delay=sched_cfg.get('discover',1800) if suo5_server_ip else 0,retry_min=retry_min,retry_max=retry_max)
+      self.add_task('upstreams',measure_upstreams,sched_cfg.get('upstreams',300),first_delay=0)
+      self.add_task('probe',self.check_suo5,sched_cfg.get('probe',60),retry_min=retry_min,retry_max=retry_max)
+      if len(tunnel.groups[0]) > 1:
+        self.add_task('backends',self.check_backends,sched_cfg.get('backends',30))
+  
+  def check_right_now(self):
+    self.trigger('probe')
+  
+  def check_login(self):  # apply login changing
+    if ex_opt.get('disable_check',False): return
+    if not _tr_login_last: return
+    if not suo5_server_ip: check_alive.trigger('discover')
     
-    counter = 0
-    while self.is_alive() and self._active:
-      counter += 1
-      
-      # check login changing every 40 seconds
-      if counter % 8 == 4 and not ex_opt.get('disable_check',False):
-        try:
-          if os.path.isfile(tr_login_file):
-            modi_tm = os.stat(tr_login_file).st_mtime
-            if tr_login_time != modi_tm:
-              if not suo5_server_ip: try_init_serv_ip()
-              
-              tr_login_time = modi_tm
-              
-              line = ''
-              b = open(tr_login_file,'rt').read().splitlines()
-              if not suo5_server_ip:
-                line = b[-1]     # auto get last line
-              else:
-                s = ',' + suo5_server_ip + ','
-                for ln in b:
-                  if ln.find(s) > 0:
-                    line = ln
-                    break
-              
-              b2 = line.split(',')
-              if len(b2) == 4:  # should be: "now,keycode,server_ip,server_port"
-                server = (b2[2],int(b2[3]))
-                when_cred_updated(int(b2[0]),b2[1],server)
-        except:
-          logger.warning(traceback.format_exc())
-      
-      # check suo5 connection every 60 seconds normally
-      if _relay_server and (self.check_right_now or (counter % 12) == 11):
-        self.check_right_now = False
-        counter = (counter // 12) * 12
-        
-        if auto_start_suo5 and is_server_cfg_ok():
-          try:
-            # step 1: check suo5 connection is OK or not
-            is_alive = check_suo5_alive()
-            
-            if not is_alive:     
-              # setp 2: find PID and kill it when connection broken
-              pid_str = find_suo5_PID()
-              if pid_str:
-                os.popen('kill -9 ' + pid_str).read()
-                time.sleep(1)
-              
-              # step 3: try restart suo5 client
-              if not find_suo5_PID():    # no suo5 client application
-                start_suo5_client()
-          except:
-            logger.warning(traceback.format_exc())
-      
-      time.sleep(5)
+    if not suo5_server_ip:
+      b2 = _tr_login_last     # auto get last line
+    else: b2 = _tr_login_index.get(suo5_server_ip)
+    
+    if b2 and b2 != self._tr_login_applied:
+      self._tr_login_applied = b2
+      server = (b2[2],int(b2[3]))
+      when_cred_updated(int(b2[0]),b2[1],server)
+  
+  def check_backends(self):   # check every suo5 client in service
+    if not _last_cred or not tunnel.running: return
+    cred = _last_cred
+    return tunnel.check_backends(lambda bk: _check_backend(bk,cred)) > 0
+  
+  def check_suo5(self):   # check suo5 connection
+    if not _relay_server: return
+    if not (auto_start_suo5 and is_server_cfg_ok()): return
+    
+    # step 1: check suo5 connection is OK or not
+    is_alive = check_suo5_alive()
+    _notify_state('probe_ok' if is_alive else 'probe_failed')
+    upstream = upstreams.on_check(is_alive)
+    if is_alive: return True
     
-    self._active = False
-    logger.info('CheckAlive thread exited')
+    # step 2: connection broken, switch to new suo5 client, use another upstream when current one fails repeatedly
+    if upstream: _use_upstream(upstream)
+    start_suo5_client(force=True)
+    return False
 
 check_alive = CheckAlive()
 
 #----
 
-from flask import request, make_response
+from flask import request
 
 from .local_web import *    # import app, APP_NAME, get_url_root
 assert app is not None, 'please call dapp_http.config_http() first'
 
+from .dapp_http import relay_stats, queue_latency, _flask_site
+
 _hostname = ''
 
 def _suo5_get_state():
   global _hostname
   if not _hostname:
-    _hostname = os.popen('hostname').read().strip()
+    _hostname = socket.gethostname()
     if _hostname[-6:].lower() != '.local': _hostname += '.local'
   
   cfg = runtime['config']
-  return { 'active': bool(find_suo5_PID()),
+  return { 'active': tunnel.running,
+    'metrics': _metrics_summary(),
+    'relay': relay_stats(),
     'hostname': '%s:%s' % (_hostname,suo5_local_host.split(':')[-1]),
     'auto_start': bool(cfg.get('auto_start_suo5',False)),
     'user_password': cfg.get('client_user_psw',''),
     'server_url': cfg.get('suo5_server_url',''),
-    'ex_opt': cfg.get('ex_opt',{}) }
+    'active_url': suo5_server_url,
+    'upstreams': upstreams.stats(),
+    'ex_opt': cfg.get('ex_opt',{}),
+    'discovery': discovery.stats(),
+    'config_store': config_store.stats(),
+    'diagnosis': _diagnosis(),
+    'token_cache': _token_stats() }
+
+def _diagnosis():
+  conn_tracker.reset_backends({bk.name for bk in tunnel.backends if bk.proc.running})
+  return conn_tracker.summary()
+
+def _metrics_summary():
+  backends = tunnel.backends
+  front = tunnel.front
+  return { 'bytes_up': sum(bk.bytes_up for bk in backends),
+    'bytes_down': sum(bk.bytes_down for bk in backends),
+    'conns_active': sum(bk.active for bk in backends),
+    'conns_total': sum(bk.total for bk in backends),
+    'connect_failures': front.connect_failures + front.no_backend,
+    'connect_p50_ms': int(front.connect_latency.quantile(0.5) * 1000),
+    'connect_p99_ms': int(front.connect_latency.quantile(0.99) * 1000),
+    'probe_ok': _probe_stats.ok, 'probe_failed': _probe_stats.failed,
+    'restarts': sum(bk.proc.restarts for bk in backends),
+    'rotations': tunnel.rotations }
+
+def _collect_metrics():
+  backends = tunnel.backends
+  front = tunnel.front
+  by_bk = lambda attr: [((('backend',bk.name),),getattr(bk,attr)) for bk in backends]
+  tok = _token_stats()
+  
+  samples = [
+    ('suo5_up','gauge','Whether suo5 client is running.',[((),tunnel.running)]),
+    ('suo5_backend_healthy','gauge','Whether backend is healthy and in rotation.',
+      [((('backend',bk.name),),bk.healthy and bk in tunnel.current) for bk in backends]),
+    ('suo5_connections_active','gauge','Active client connections.',by_bk('active')),
+    ('suo5_connections_total','counter','Accepted client connections.',by_bk('total')),
+    ('suo5_bytes_total','counter','Bytes forwarded through tunnel.',
+      [((('backend',bk.name),('direction','up')),bk.bytes_up) for bk in backends] +
+      [((('backend',bk.name),('direction','down')),bk.bytes_down) for bk in backends]),
+    ('suo5_connect_failures_total','counter','Client connections failed to reach suo5 client.',
+      [((('reason','connect'),),front.connect_failures),((('reason','no_backend'),),front.no_backend)]),
+    ('suo5_connect_latency_seconds','histogram','Latency of connecting to suo5 client.',[((),front.connect_latency)]),
+    ('suo5_probe_total','counter','Tunnel probe attempts.',
+      [((('result','ok'),),_probe_stats.ok),((('result','failed'),),_probe_stats.failed)]),
+    ('suo5_probe_latency_seconds','histogram','Latency of tunnel probe attempts.',[((),_probe_stats.latency)]),
+    ('suo5_client_starts_total','counter','Starts of suo5 client process.',
+      [((('backend',bk.name),),bk.proc.starts) for bk in backends]),
+    ('suo5_client_restarts_total','counter','Restarts after suo5 client exits unexpectedly.',
+      [((('backend',bk.name),),bk.proc.restarts) for bk in backends]),
+    ('suo5_rotations_total','counter','Blue/green rotations of suo5 clients.',[((),tunnel.rotations)]) ]
+  
+  if len(upstreams.upstreams) > 1:
+    by_url = lambda fn: [((('upstream',u.url),),fn(u)) for u in upstreams.upstreams]
+    samples.extend([
+      ('suo5_upstream_up','gauge','Whether upstream suo5 server is reachable.',by_url(lambda u: u.healthy)),
+      ('suo5_upstream_active','gauge','Whether upstream is used by suo5 client.',by_url(lambda u: u is upstreams.current)),
+      ('suo5_upstream_rtt_seconds','gauge','Smoothed time of direct request to upstream.',by_url(lambda u: u.rtt or 0)),
+      ('suo5_upstream_throughput_bytes','gauge','Smoothed tunnel throughput (bytes/s) while upstream is in use.',
+        by_url(lambda u: u.throughput or 0)),
+      ('suo5_upstream_failovers_total','counter','Failovers away from upstream.',by_url(lambda u: u.failovers)) ])
+  
+  relay = relay_stats()
+  samples.append(('dapp_request_queue_seconds','histogram','Waiting time of requests before a WSGI thread runs them.',
+    [((),queue_latency)]))
+  if 'conns' in relay:
+    samples.extend([
+      ('dapp_relay_connections','gauge','Relay connections to tr-client.',
+        [((('state','open'),),relay['conns']),((('state','connecting'),),relay['connecting']),
+         ((('state','busy'),),relay['busy']),((('state','limit'),),relay['conn_num'])]),
+      ('dapp_relay_requests_total','counter','Requests received from relay connections.',[((),relay['requests'])]),
+      ('dapp_relay_events_total','counter','Relay connection events.',
+        [((('event',k),),relay[k]) for k in ('connects','connect_failures','lost','failovers')]),
+      ('dapp_relay_up','gauge','Whether relay is healthy.',[((('relay',r['relay']),),r['healthy']) for r in relay['relays']]),
+      ('dapp_relay_rtt_seconds','gauge','Smoothed TCP connect time of relay.',
+        [((('relay',r['relay']),),(r['rtt_ms'] or 0) / 1000) for r in relay['relays']]),
+      ('dapp_relay_connections_by_relay','gauge','Relay connections of each relay.',
+        [((('relay',r['relay']),),r['conns']) for r in relay['relays']]) ])
+  
+  if tok:
+    samples.append(('dapp_token_cache_total','counter','Login token cache lookups.',
+      [((('result',k),),tok.get(k,0)) for k in ('hits','misses','bad_hits','reloads')]))
+  return samples
+
+@app.route('/metrics')
+def suo5_metrics():
+  return (render_prometheus(_collect_metrics()),200,{'Content-Type':'text/plain; version=0.0.4; charset=utf-8'})
+
+_state_hub = EventHub(max_subscribers=16)
+
+def _notify_state(reason):
+  if not _state_hub.subscribers: return   # nobody is listening
+  try:
+    _state_hub.publish('state',dict(_suo5_get_state(),reason=reason))
+  except:
+    logger.warning(traceback.format_exc())
+
+def _native_state_stream(request):   # answered in reactor thread, idle pages hold no WSGI thread
+  return sse_render(_state_hub,request,lambda: ('state',dict(_suo5_get_state(),reason='init')))
+
+_flask_site.add_route('/state/stream',_native_state_stream)
 
 @app.route('/state', methods=['GET','POST'])
 def suo5_get_state():
@@ -312,65 +509,109 @@ def suo5_get_state():
       
       data = request.get_json(force=True,silent=True)
       new_state = data.get('state','')
+      job = None
       if new_state == 'CLOSED':
-        pid_str = find_suo5_PID()
-        if pid_str:
+        if tunnel.running:
           logger.info('try stop suo5 client.')
-          os.popen('kill -9 ' + pid_str).read()
+          job = jobs.submit('stop',stop_suo5_client)
       elif new_state == 'RUNNING':
-        if not find_suo5_PID():
-          start_suo5_client()
-      return {'result':'success'}
+        if not tunnel.running:
+          job = jobs.submit('start',start_suo5_client)
+      
+      if job is None: return {'result':'success'}
+      return ({'result':'success','job':job.id},202)
   
   except:
     logger.warning(traceback.format_exc())
   return ('FORMAT_ERROR',400)
 
+@app.route('/logs')
+def suo5_get_logs():   # output events of suo5 clients, poll with '?since=<seq>'
+  if not _check_token_ok(request): return ('INVALID_TOKEN',401)
+  try:
+    since = int(request.args.get('since',0))
+    limit = min(int(request.args.get('limit',200)),1000)
+  except ValueError:
+    return ('INVALID_PARAMETER',400)
+  events = client_log.events(since,limit,request.args.get('backend',''),request.args.get('kind',''))
+  return {'seq': client_log.seq, 'stats': client_log.stats(), 'events': events}
+
+@app.route('/jobs/<job_id>')
+def suo5_get_job(job_id):
+  job = jobs.get(job_id)
+  if job is None: return ('NOT_FOUND',404)
+  return job.info()
+
+# fields that appear in command line of suo5 client, changing them requires a restart
+_RESTART_KEYS = ('client_user_psw','ex_opt.user_agent','ex_opt.with_get_method','ex_opt.with_no_gzip','ex_opt.with_cookiejar')
+
+def _apply_config(changed):   # apply runtime['config'] to globals, return True when suo5 client should restart
+  global auto_start_suo5, suo5_server_urls, client_user_psw, ex_opt
+  
+  cfg = runtime['config']
+  auto_start_suo5 = bool(cfg.get('auto_start_suo5',False))
+  client_user_psw = cfg.get('client_user_psw','')
+  ex_opt = cfg.get('ex_opt',{})
+  
+  active_url = suo5_server_url
+  server_urls = parse_urls(cfg.get('suo5_server_url',''))
+  if server_urls and server_urls != suo5_server_urls:
+    suo5_server_urls = server_urls
+    upstreams.config(server_urls)
+    _use_upstream(upstreams.current or upstreams.best())   # keep current one when it is still listed
+    check_alive.trigger('upstreams')
+  
+  if any(k.startswith('schedule.') for k in changed):
+    check_alive.config(cfg.get('schedule',{}))
+  if 'ex_opt.disable_check' in changed and not ex_opt.get('disable_check',False):
+    check_alive.trigger('tr_login')   # checking resumed, catch up with login changes
+    check_alive.check_right_now()
+  
+  static = [k for k in changed if k.split('.')[0] in ('suo5_local_host','find_client_pid','backend_num','drain_timeout','client_log')]
+  if static: logger.info('%s will take effect after restarting the dapp',', '.join(static))
+  
+  if changed: _notify_state('config')
+  return suo5_server_url != active_url or any(k in _RESTART_KEYS for k in changed)
+
+def _reconfigure(changed, kick=False):   # return the job of starting or stopping suo5 client, or None
+  restart = _apply_config(changed)
+  if not auto_start_suo5:
+    if tunnel.running:
+      logger.info('try stop suo5 client.')
+      return jobs.submit('stop',stop_suo5_client)
+  elif restart or (not tunnel.running and (kick or 'auto_start_suo5' in changed)):
+    # old client keeps working until new one is ready
+    return jobs.submit('start',start_suo5_client,True)
+  return None
+
+def _job_result(job):
+  return ({'result':'success','job':job.id},202) if job else {'result':'success'}
+
 @app.route('/change_config', methods=['POST'])
 def suo5_change_cfg():
-  global suo5_server_ip, auto_start_suo5, suo5_server_url, client_user_psw
-  
   try:
     if not _check_token_ok(request): return ('INVALID_TOKEN',401)
     
-    # step 1: check args
+    # step 1: check args, server_url can be one url, urls separated by whitespace, or list of urls
     data = request.get_json(force=True,silent=True)
-    server_url = data.get('server_url','')
+    server_urls = parse_urls(data.get('server_url',''))
     user_passw = data.get('user_password','')
     auto_start = bool(data.get('auto_start',False))
-    if not server_url or (user_passw and len(user_passw.split(':')) != 2):
+    if not server_urls or any(url[:4] != 'http' for url in server_urls) or (user_passw and len(user_passw.split(':')) != 2):
       return ('INVALID_PARAMETER',400)
     
-    # step 2: change global variables
-    cfg = runtime['config']
-    if cfg.get('suo5_server_url') != server_url:
-      suo5_server_ip = ''
+    # step 2: change config, it is saved to config.json in background
+    changed = config_store.update({ 'auto_start_suo5':auto_start, 'client_user_psw':user_passw,
+      'suo5_server_url':server_urls[0] if len(server_urls) == 1 else server_urls })
     
-    auto_start_suo5 = cfg['auto_start_suo5'] = auto_start
-    suo5_server_url = cfg['suo5_server_url'] = server_url
-    client_user_psw = cfg['client_user_psw'] = user_passw
-    
-    # step 3: save config.json
-    cfg.save()
-    
-    # step 4: try restart suo5 client
-    pid_str = find_suo5_PID()
-    if pid_str:
-      logger.info('try stop suo5 client.')
-      os.popen('kill -9 ' + pid_str).read()
-    
-    if auto_start and not find_suo5_PID():
-      Timer(1,start_suo5_client).start()
-    
-    return {'result':'success'}
+    # step 3: restart suo5 client only when needed
+    return _job_result(_reconfigure(changed,kick=True))
   except:
     logger.warning(traceback.format_exc())
   return ('FORMAT_ERROR',400)
 
 @app.route('/change_exopt', methods=['POST'])
 def suo5_change_exopt():
-  global ex_opt
-  
   try:
     if not _check_token_ok(request): return ('INVALID_TOKEN',401)
     
@@ -382,24 +623,39 @@ def suo5_change_exopt():
     with_cookiejar = bool(data.get('with_cookiejar',False))
     user_agent = data.get('user_agent','')
     
-    # step 2: change global variables
-    cfg = runtime['config']
-    ex_opt = cfg['ex_opt'] = { 'disable_check':disable_check, 'with_get_method':with_get_method,
-      'with_no_gzip':with_no_gzip, 'with_cookiejar':with_cookiejar, 'user_agent':user_agent }
-    
-    # step 3: save config.json
-    cfg.save()
-    
-    # step 4: try restart suo5 client
-    pid_str = find_suo5_PID()
-    if pid_str:
-      logger.info('try stop suo5 client.')
-      os.popen('kill -9 ' + pid_str).read()
+    # step 2: change config, it is saved to config.json in background
+    changed = config_store.update({ 'ex_opt': { 'disable_check':disable_check, 'with_get_method':with_get_method,
+      'with_no_gzip':with_no_gzip, 'with_cookiejar':with_cookiejar, 'user_agent':user_agent } })
     
-    if cfg.get('auto_start_suo5',False) and not find_suo5_PID():
-      Timer(1,start_suo5_client).start()
+    # step 3: restart suo5 client only when needed
+    return _job_result(_reconfigure(changed,kick=True))
+  except:
+    logger.warning(traceback.format_exc())
+  return ('FORMAT_ERROR',400)
+
+
+@app.route('/tune', methods=['GET','POST'])
+def suo5_tune():
+  if not _check_token_ok(request): return ('INVALID_TOKEN',401)   # result shows target_url and options
+  if request.method == 'GET': return tuner.result
+  
+  try:
+    # step 1: check args, missing ones come from "tune" of config.json
+    data = request.get_json(force=True,silent=True) or {}
+    tune_cfg = runtime['config'].get('tune',{})
+    target_url = data.get('target_url') or tune_cfg.get('target_url') or ''   # suo5 server answers tiny body, not a target
+    options = data.get('options') or tune_cfg.get('options') or list(TUNE_OPTIONS)
+    if not target_url: return ('MISSING_TARGET_URL',400)
+    rounds = int(data.get('rounds') or tune_cfg.get('rounds',3))
+    max_bytes = int(data.get('max_kb') or tune_cfg.get('max_kb',4096)) * 1024
+    if target_url[:4] != 'http' or any(opt not in TUNE_OPTIONS for opt in options) or not 1 <= rounds <= 20:
+      return ('INVALID_PARAMETER',400)
+    if not is_server_cfg_ok() or suo5_bin is None: return ('NOT_CONFIGURED',400)
+    if tuner.running: return ('BUSY',409)
     
-    return {'result':'success'}
+    # step 2: run in background, state of tuning is returned by GET /tune
+    job = jobs.submit('tune',run_tune,target_url,tuple(options),rounds,max_bytes,bool(data.get('apply',False)))
+    return ({'result':'success','job':job.id},202)
   except:
     logger.warning(traceback.format_exc())
   return ('FORMAT_ERROR',400)
@@ -1,18 +1,43 @@
 # dapp_http.py
 
-import hashlib
+import logging
+logger = logging.getLogger(__name__)
+
+import time, socket, random, hashlib
 from binascii import hexlify
 
 from twisted.internet import reactor
+from twisted.internet.protocol import ClientFactory, Protocol
 from twisted.web.wsgi import WSGIResource
 
 from nbcc.dapp_lib.dapp_conn import HttpCtrlBlock, MyHttpFactory
 
+from .metrics import Histogram
+from .static_cache import StaticCache, FrontResource
+
 _app = None
-_flask_site = None
+_flask_site = None     # FrontResource that wraps WSGI resource
+_static_cache = None
+_relay_pool = None
+
+queue_latency = Histogram()   # waiting time of requests in thread pool, only observed in reactor thread
+
+class _TimedWSGIResource(WSGIResource):
+  def render(self, request):
+    # stamp arriving time, WSGI app gets queueing time from it when running in pool thread
+    request.requestHeaders.setRawHeaders(b'x-dapp-received',[b'%.6f' % time.monotonic()])
+    if _relay_pool and request.requestHeaders.hasHeader(b'x-nbc-sn'):   # from tr-client
+      _relay_pool.on_request(request)
+    return WSGIResource.render(self,request)
+
+def _observe_queue_time():   # flask before_request hook
+  from flask import request
+  tm = request.environ.get('HTTP_X_DAPP_RECEIVED')
+  if tm:
+    reactor.callFromThread(queue_latency.observe,max(0.0,time.monotonic() - float(tm)))
 
 def config_http(static_dir=None, static_url=None):
-  global _app, _flask_site
+  global _app, _flask_site, _static_cache
   if _app: return _app
   
   import os
@@ -20,19 +45,272 @@ def config_http(static_dir=None, static_url=None):
   folder = static_dir or os.path.abspath('./static')
   url = static_url or '/static'
   _app = Flask(__name__,static_folder=folder,static_url_path=url)
-  _flask_site = WSGIResource(reactor,reactor.getThreadPool(),_app)
+  _app.before_request(_observe_queue_time)
+  
+  # static files and routes added by _flask_site.add_route() are answered in reactor thread,
+  # others go to flask in thread pool
+  _static_cache = StaticCache(folder).build()
+  wsgi_site = _TimedWSGIResource(reactor,reactor.getThreadPool(),_app)
+  _flask_site = FrontResource(wsgi_site,_static_cache,url)
   
   return _app
 
-def check_connections(relay_serv, HCB):
-  # step 1: try add more connections
-  if len(HCB.conns) < HCB.conn_num:
-    reactor.connectTCP(relay_serv[0],relay_serv[1],MyHttpFactory(_flask_site,HCB),timeout=30)
+def _set_keepalive(transport, idle=60, interval=10, count=3):
+  # idle connection is probed by kernel, dead peer is found in idle+interval*count seconds
+  try:
+    transport.setTcpKeepAlive(1)
+    sock = transport.getHandle()
+    for name, value in ( ('TCP_KEEPIDLE',idle), ('TCP_KEEPINTVL',interval), ('TCP_KEEPCNT',count),
+        ('TCP_USER_TIMEOUT',(idle + interval * count) * 1000) ):  # also for unacked sending
+      if hasattr(socket,name):
+        sock.setsockopt(socket.IPPROTO_TCP,getattr(socket,name),value)
+  except (AttributeError,OSError): pass
+
+class _PoolFactory(MyHttpFactory):
+  def __init__(self, pool, relay):
+    MyHttpFactory.__init__(self,pool.site,pool.HCB)
+    self.pool = pool
+    self.relay = relay
+    self.proto = None
+    self.retired = False   # closed by rebalancing
+    self.started_at = time.monotonic()
+    self.connected_at = 0
+  
+  def buildProtocol(self, addr):
+    self.proto = proto = MyHttpFactory.buildProtocol(self,addr)
+    self.connected_at = time.monotonic()
+    self.pool.on_connected(self)
+    reactor.callLater(0,lambda: proto.transport and _set_keepalive(proto.transport))
+    return proto
+  
+  def clientConnectionFailed(self, connector, reason):
+    MyHttpFactory.clientConnectionFailed(self,connector,reason)
+    self.pool.on_failed(self,reason)
+  
+  def clientConnectionLost(self, connector, reason):
+    MyHttpFactory.clientConnectionLost(self,connector,reason)
+    self.pool.on_lost(self,reason)
+
+class _ProbeProtocol(Protocol):
+  def connectionMade(self):
+    self.factory.done(True)
+    self.transport.abortConnection()
+
+class _ProbeFactory(ClientFactory):   # measure TCP connect time of a relay
+  protocol = _ProbeProtocol
+  
+  def __init__(self, relay, callback):
+    self.relay = relay
+    self.callback = callback
+    self.started_at = time.monotonic()
+  
+  def done(self, ok):
+    if self.callback:
+      self.callback(self.relay,time.monotonic() - self.started_at if ok else None)
+      self.callback = None
+  
+  def clientConnectionFailed(self, connector, reason):
+    self.done(False)
+
+class Relay:
+  def __init__(self, host, port):
+    self.addr = (host,port)
+    self.rtt = None          # smoothed connect time, in seconds
+    self.healthy = True
+    self.target = 0          # planned number of connections
+    self.conns = set()       # _PoolFactory of opened connections
+    self.connecting = 0
+    self.connects = 0
+    self.connect_failures = 0
+    self.lost = 0
+    self.fails = 0           # continuous failures, for backoff
+    self.fill_call = None
+  
+  def __str__(self):
+    return '%s:%s' % self.addr
+  
+  def update_rtt(self, seconds):
+    self.rtt = seconds if self.rtt is None else self.rtt * 0.7 + seconds * 0.3
+  
+  def stats(self):
+    return { 'relay': str(self), 'healthy': self.healthy, 'rtt_ms': round(self.rtt * 1000,1) if self.rtt is not None else None,
+      'target': self.target, 'conns': len(self.conns), 'connecting': self.connecting, 'connects': self.connects,
+      'connect_failures': self.connect_failures, 'lost': self.lost }
+
+class RelayPool:   # spread conn_num connections over relays by connect time, only run in reactor thread
+  def __init__(self, relays, HCB, site, check_interval=15, probe_interval=30, retry_min=1, retry_max=90):
+    self.relays = [Relay(host,port) for host, port in relays]
+    self.HCB = HCB
+    self.site = site
+    self.check_interval = check_interval
+    self.probe_interval = probe_interval
+    self.retry_min = retry_min
+    self.retry_max = retry_max
+    
+    self.busy = 0          # relayed requests in processing
+    self.busy_peak = 0
+    self.requests = 0
+    self.failovers = 0
+    self._retiring = 0
   
-  # step 2: set checking later, run every 90 seconds
-  reactor.callLater(90,check_connections,relay_serv,HCB)
+  def start(self):
+    self._plan()
+    for relay in self.relays: self._fill(relay)
+    reactor.callLater(self.check_interval,self._check)
+    if len(self.relays) > 1: self._probe_all()
+  
+  def stats(self):
+    conns = len(self.HCB.conns)
+    return { 'relay': ','.join(str(r) for r in self.relays if r.target), 'conn_num': self.HCB.conn_num,
+      'conns': conns, 'connecting': sum(r.connecting for r in self.relays),
+      'busy': self.busy, 'busy_peak': self.busy_peak, 'occupancy': round(self.busy / conns,2) if conns else 0,
+      'requests': self.requests, 'failovers': self.failovers,
+      'connects': sum(r.connects for r in self.relays),
+      'connect_failures': sum(r.connect_failures for r in self.relays),
+      'lost': sum(r.lost for r in self.relays),
+      'relays': [r.stats() for r in self.relays] }
+  
+  def _plan(self):   # share of a relay is in proportion to 1/rtt, every healthy relay has one at least
+    relays = [r for r in self.relays if r.healthy] or self.relays
+    known = [r.rtt for r in relays if r.rtt is not None]
+    default_rtt = sum(known) / len(known) if known else 0.1
+    weights = [1 / max(r.rtt if r.rtt is not None else default_rtt,0.001) for r in relays]
+    
+    total = self.HCB.conn_num
+    base = min(1,total // len(relays))
+    left = total - base * len(relays)
+    shares = [left * w / sum(weights) for w in weights]
+    targets = [base + int(s) for s in shares]
+    order = sorted(range(len(relays)),key=lambda i: shares[i] - int(shares[i]),reverse=True)
+    for i in order[:total - sum(targets)]:   # largest remainder
+      targets[i] += 1
+    
+    old = [r.target for r in self.relays]
+    for r in self.relays: r.target = 0
+    for r, n in zip(relays,targets): r.target = n
+    if old != [r.target for r in self.relays]:
+      logger.info('relay plan: %s',', '.join('%s=%i(%s)' % (r,r.target,
+        'down' if not r.healthy else '%.1fms' % (r.rtt * 1000) if r.rtt is not None else '?') for r in self.relays))
+      return True
+    return False
+  
+  def _rebalance(self):
+    self._plan()
+    for relay in self.relays:
+      if not relay.fill_call: self._fill(relay)
+    
+    # move connections one by one, retire an extra one of relay over target when others are waiting for it
+    # off by one is tolerated unless a healthy relay has no connection, avoid moving back and forth as rtt jitters
+    if self._retiring: return
+    waiting = [r for r in self.relays if r.healthy and len(r.conns) + r.connecting < r.target]
+    if waiting:
+      empty = any(not r.conns and not r.connecting for r in waiting)
+      for relay in self.relays:
+        if len(relay.conns) > relay.target + (0 if empty or not relay.healthy else 1):
+          factory = next(iter(relay.conns))
+          factory.retired = True
+          self._retiring += 1
+          factory.proto.transport.loseConnection()
+          break
+  
+  def _set_health(self, relay, healthy):
+    if relay.healthy == healthy: return
+    relay.healthy = healthy
+    logger.warning('relay %s is %s',relay,'up' if healthy else 'down')
+    if not healthy and relay.target: self.failovers += 1
+    self._rebalance()
+  
+  def _probe_all(self):
+    for relay in self.relays:
+      reactor.connectTCP(relay.addr[0],relay.addr[1],_ProbeFactory(relay,self._on_probed),timeout=10)
+    reactor.callLater(self.probe_interval,self._probe_all)
+  
+  def _on_probed(self, relay, seconds):
+    if seconds is None:
+      self._set_health(relay,False)
+    else:
+      relay.update_rtt(seconds)
+      if relay.healthy:
+        self._rebalance()   # rtt changed
+      else: self._set_health(relay,True)
+  
+  def _fill(self, relay):   # ramp up in parallel, total connections not exceed conn_num
+    relay.fill_call = None
+    free = self.HCB.conn_num - sum(len(r.conns) + r.connecting for r in self.relays)
+    for i in range(min(free,relay.target - len(relay.conns) - relay.connecting)):
+      relay.connecting += 1
+      reactor.connectTCP(relay.addr[0],relay.addr[1],_PoolFactory(self,relay),timeout=30)
+  
+  def _schedule_fill(self, relay, delay):   # keep the earlier one
+    if relay.fill_call and relay.fill_call.active():
+      if relay.fill_call.getTime() <= reactor.seconds() + delay: return
+      relay.fill_call.cancel()
+    relay.fill_call = reactor.callLater(delay,self._fill,relay)
+  
+  def _backoff(self, relay):   # count once for every round of connecting
+    if relay.fill_call and relay.fill_call.active(): return
+    relay.fails += 1
+    delay = min(self.retry_min * 2 ** (relay.fails - 1),self.retry_max)
+    self._schedule_fill(relay,delay * random.uniform(0.5,1.5))
+  
+  def _check(self):   # connections may be removed by others, such as rejected by relay
+    for relay in self.relays:
+      if len(relay.conns) >= relay.target:
+        relay.fails = 0
+    self._rebalance()
+    reactor.callLater(self.check_interval,self._check)
+  
+  def on_connected(self, factory):
+    relay = factory.relay
+    relay.connecting = max(0,relay.connecting - 1)
+    relay.connects += 1
+    relay.conns.add(factory)
+    relay.update_rtt(factory.connected_at - factory.started_at)
+  
+  def on_failed(self, factory, reason):
+    relay = factory.relay
+    relay.connecting = max(0,relay.connecting - 1)
+    relay.connect_failures += 1
+    self._backoff(relay)
+    if len(self.relays) > 1:
+      self._set_health(relay,False)   # move its share to others at once
+      self._rebalance()               # slots of failed connecting are free now
+  
+  def on_lost(self, factory, reason):
+    relay = factory.relay
+    relay.conns.discard(factory)
+    if factory.retired:
+      self._retiring -= 1
+      self._rebalance()
+      return
+    
+    relay.lost += 1
+    if time.monotonic() - factory.connected_at < 10:   # rejected soon after connected, avoid reconnecting in a busy loop
+      self._backoff(relay)
+    else:
+      relay.fails = 0
+      self._schedule_fill(relay,random.uniform(0,1))   # reconnect at once, jitter avoids all dapps rushing in
+  
+  def on_request(self, request):
+    self.requests += 1
+    self.busy += 1
+    self.busy_peak = max(self.busy_peak,self.busy)
+    request.notifyFinish().addBoth(self._on_finished)
+  
+  def _on_finished(self, _):
+    self.busy -= 1
+
+def relay_stats():
+  ret = _relay_pool.stats() if _relay_pool else {}
+  ret['queue_p50_ms'] = int(queue_latency.quantile(0.5) * 1000)
+  ret['queue_p99_ms'] = int(queue_latency.quantile(0.99) * 1000)
+  return ret
 
 def start_web_service(relay_serv, lcns_info, conn_nonce=None, app_name=None):
+  # relay_serv is (host,port) or a list of it, connections are spread over relays
+  global _relay_pool
+  relays = [relay_serv] if isinstance(relay_serv[0],str) else list(relay_serv)
+  
   if lcns_info:
     conn_num = lcns_info[3]._._conn_num
     cred_1 = hexlify(lcns_info[5])
@@ -51,7 +329,7 @@ def start_web_service(relay_serv, lcns_info, conn_nonce=None, app_name=None):
     cred_sig = hashlib.sha256(hashlib.sha256(cred_1).digest()+b':'+conn_nonce).digest()[:4]
     HCB = HttpCtrlBlock('',1,b'BUILTIN',cred_1,hexlify(conn_nonce),hexlify(cred_sig))
   
-  reactor.connectTCP(relay_serv[0],relay_serv[1],MyHttpFactory(_flask_site,HCB),timeout=30)
-  reactor.callLater(40,check_connections,relay_serv,HCB)
+  _relay_pool = RelayPool(relays,HCB,_flask_site)
+  _relay_pool.start()
   
   return HCB
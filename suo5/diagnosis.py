@@ -0,0 +1,159 @@
+# diagnosis.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import time, heapq
+from collections import deque
+from threading import Lock
+
+from .metrics import Histogram
+
+OTHER = '(other)'   # targets evicted from a full bucket are merged into it
+
+class _Target:
+  __slots__ = ('conns','errors','closed','bytes','latency','last_error')
+
+  def __init__(self):
+    self.conns = 0
+    self.errors = 0
+    self.closed = 0
+    self.bytes = 0
+    self.latency = None     # Histogram, created when first latency observed
+    self.last_error = ''
+
+  def merge(self, other):
+    self.conns += other.conns
+    self.errors += other.errors
+    self.closed += other.closed
+    self.bytes += other.bytes
+    if other.last_error: self.last_error = other.last_error
+    if other.latency:
+      if self.latency is None: self.latency = Histogram()
+      h = self.latency
+      for i, n in enumerate(other.latency.counts): h.counts[i] += n
+      h.sum += other.latency.sum
+      h.count += other.latency.count
+
+class _Bucket:   # stats of one time slice, keeps at most 'capacity' targets
+  def __init__(self, start, capacity):
+    self.start = start
+    self.capacity = capacity
+    self.targets = {}
+
+  def get(self, target):
+    item = self.targets.get(target)
+    if item is None:
+      if len(self.targets) >= self.capacity:   # evict the smallest one, heavy hitters survive
+        victim = min((t for t in self.targets if t != OTHER),key=lambda t: self.targets[t].conns + self.targets[t].errors)
+        other = self.targets.setdefault(OTHER,_Target())
+        other.merge(self.targets.pop(victim))
+      item = self.targets[target] = _Target()
+    return item
+
+class ConnTracker:   # live connection stats from suo5 client output, bounded by window and capacity
+  def __init__(self, window=600, bucket_seconds=30, capacity=64, max_pending=256):
+    self.bucket_seconds = bucket_seconds
+    self.capacity = capacity
+    self.max_pending = max_pending
+    self._buckets = deque(maxlen=max(1,window // bucket_seconds))
+    self._open = {}       # {(backend,target): deque of [open_time,ready]}, connections not closed yet
+    self._lock = Lock()
+
+  @property
+  def window(self):
+    return self._buckets.maxlen * self.bucket_seconds
+
+  def _bucket(self, now):
+    start = now - now % self.bucket_seconds
+    if not self._buckets or self._buckets[-1].start != start:
+      self._buckets.append(_Bucket(start,self.capacity))
+    return self._buckets[-1]
+
+  def on_event(self, event):   # listener of ClientLog, called in pipe reader threads
+    kind = event['kind']
+    target = event['target']
+    if kind not in ('open','ready','close','error') or not target: return
+
+    now = time.monotonic()
+    key = (event['backend'],target)
+    with self._lock:
+      item = self._bucket(now).get(target)
+      pending = self._open.get(key)
+      latency = event['ms'] / 1000 if event['ms'] is not None else None
+
+      if kind == 'open':
+        item.conns += 1
+        if pending is None:
+          if len(self._open) >= self.capacity * 4: return   # too many targets in flight, only counted
+          pending = self._open[key] = deque(maxlen=self.max_pending)
+        pending.append([now,False])
+        return
+
+      # match the oldest not-ready connection for 'ready' and 'error', the oldest one for 'close'
+      conn = None
+      if pending:
+        if kind == 'close':
+          conn = pending.popleft()
+        else:
+          for c in pending:
+            if not c[1]:
+              conn = c
+              break
+          if conn and kind == 'error': pending.remove(conn)
+        if not pending: del self._open[key]
+
+      if kind == 'ready':
+        if conn: conn[1] = True
+        if latency is None and conn: latency = now - conn[0]
+      elif kind == 'error':
+        item.errors += 1
+        item.last_error = event['text'][-200:]
+        if latency is None and conn: latency = now - conn[0]
+      else:
+        item.closed += 1
+        item.bytes += event['bytes']
+        latency = None   # duration of connection is not latency
+
+      if latency is not None:
+        if item.latency is None: item.latency = Histogram()
+        item.latency.observe(latency)
+
+  def reset_backends(self, alive):   # drop in-flight connections of clients that not running
+    with self._lock:
+      for key in [k for k in self._open if k[0] not in alive]:
+        del self._open[key]
+
+  def summary(self, k=10):
+    now = time.monotonic()
+    with self._lock:
+      merged = {}
+      for b in self._buckets:
+        if b.start + self.bucket_seconds <= now - self.window: continue
+        for target, item in b.targets.items():
+          m = merged.get(target)
+          if m is None: m = merged[target] = _Target()
+          m.merge(item)
+      active = {}
+      for (backend,target), pending in self._open.items():
+        active[target] = active.get(target,0) + len(pending)
+
+    def row(target, m):
+      ret = { 'target': target, 'conns': m.conns, 'errors': m.errors, 'active': active.get(target,0),
+        'error_rate': round(m.errors / m.conns,3) if m.conns else 0, 'bytes': m.bytes, 'last_error': m.last_error }
+      if m.latency and m.latency.count:
+        ret.update(latency_n=m.latency.count,p50_ms=int(m.latency.quantile(0.5) * 1000),
+          p95_ms=int(m.latency.quantile(0.95) * 1000),avg_ms=int(m.latency.sum / m.latency.count * 1000))
+      return ret
+
+    items = [(t,m) for t,m in merged.items() if t != OTHER]
+    slow = [(t,m) for t,m in items if m.latency and m.latency.count >= 3]
+    return { 'window': self.window,
+      'active': sum(active.values()),
+      'targets': len(merged),
+      'conns': sum(m.conns for m in merged.values()),
+      'errors': sum(m.errors for m in merged.values()),
+      'top': [row(t,m) for t,m in heapq.nlargest(k,items,key=lambda x: x[1].conns)],
+      'failing': [row(t,m) for t,m in heapq.nlargest(k,[x for x in items if x[1].errors],key=lambda x: (x[1].errors,x[1].conns))],
+      'slow': [row(t,m) for t,m in heapq.nlargest(k,slow,key=lambda x: x[1].latency.quantile(0.95))],
+      'active_top': heapq.nlargest(k,active.items(),key=lambda x: x[1]) }
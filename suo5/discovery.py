@@ -0,0 +1,194 @@
+# discovery.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os, ssl, json, time, socket, threading, http.client
+from urllib.parse import urlsplit
+
+try:
+  import dns.resolver    # optional, gives real TTL of DNS records
+except ImportError:
+  dns = None
+
+def _is_ip(host):
+  for family in (socket.AF_INET,socket.AF_INET6):
+    try:
+      socket.inet_pton(family,host)
+      return True
+    except OSError: pass
+  return False
+
+class DnsCache:   # {(host,port): (expire,[addr,...])}, stale result is used when lookup failed
+  def __init__(self, ttl=300, min_ttl=30, max_ttl=3600):
+    self.ttl = ttl           # used when real TTL is unknown (resolved by getaddrinfo)
+    self.min_ttl = min_ttl
+    self.max_ttl = max_ttl
+    self._entries = {}
+    self.hits = 0
+    self.misses = 0
+
+  def resolve(self, host, port):
+    key = (host,port)
+    item = self._entries.get(key)
+    now = time.monotonic()
+    if item and item[0] > now:
+      self.hits += 1
+      return item[1]
+
+    self.misses += 1
+    try:
+      addrs, ttl = self._lookup(host,port)
+    except OSError:
+      if item: return item[1]
+      raise
+    self._entries[key] = (now + ttl,addrs)
+    return addrs
+
+  def invalidate(self, host, port):
+    self._entries.pop((host,port),None)
+
+  def _lookup(self, host, port):
+    if _is_ip(host): return [(host,port)], self.max_ttl
+
+    if dns is not None:
+      try:
+        answer = dns.resolver.resolve(host,'A',lifetime=5)
+        ttl = min(max(answer.rrset.ttl,self.min_ttl),self.max_ttl)
+        return [(r.address,port) for r in answer], ttl
+      except dns.exception.DNSException: pass   # try system resolver
+
+    addrs = []
+    for info in socket.getaddrinfo(host,port,type=socket.SOCK_STREAM):
+      addr = info[4][:2]
+      if addr not in addrs: addrs.append(addr)
+    return addrs, self.ttl
+
+class ServerDiscovery:   # ask suo5 server for its (ip,port), reuse DNS result, connection and TLS session
+  def __init__(self, state_file, timeout=10):
+    self.state_file = state_file
+    self.timeout = timeout
+    self.dns = DnsCache()
+    self._ctx = ssl.create_default_context()
+    self._sessions = {}    # {(host,port): SSLSession}
+    self._conn = None      # kept-alive connection
+    self._conn_key = None  # (scheme,host,port) of self._conn
+    self._tls_sock = None  # SSLSocket of self._conn, http.client drops conn.sock when response will close
+    self._lock = threading.Lock()
+
+    self.server = None     # last known (ip,port)
+    self.updated = 0
+    self.ok = 0
+    self.failed = 0
+    self.reused = 0        # queries sent over kept-alive connection
+    self.resumed = 0       # TLS handshakes resumed from cached session
+
+  def load(self, url):   # return persisted (ip,port) of url, or None
+    self.server = None
+    try:
+      with open(self.state_file,'r') as f:
+        data = json.load(f)
+      if data.get('url') == url:
+        self.server = (data['ip'],int(data['port']))
+        self.updated = data.get('time',0)
+        return self.server
+    except (OSError,ValueError,KeyError,TypeError): pass
+    return None
+
+  def _save(self, url):
+    tmp = self.state_file + '.tmp'
+    try:
+      with open(tmp,'w') as f:
+        json.dump({'url':url,'ip':self.server[0],'port':self.server[1],'time':self.updated},f)
+      os.replace(tmp,self.state_file)
+    except OSError as e:
+      logger.warning('save %s failed: %s',self.state_file,e)
+
+  def _close(self):
+    if self._conn:
+      self._conn.close()
+      self._conn = self._conn_key = self._tls_sock = None
+
+  def _open(self, scheme, host, port):
+    last_err = None
+    for addr in self.dns.resolve(host,port):
+      try:
+        sock = socket.create_connection(addr,timeout=self.timeout)
+      except OSError as e:
+        last_err = e
+        continue
+
+      if scheme == 'https':
+        try:
+          sock = self._ctx.wrap_socket(sock,server_hostname=host,session=self._sessions.get((host,port)))
+        except:
+          sock.close()
+          raise
+        if sock.session_reused: self.resumed += 1
+        self._tls_sock = sock
+
+      conn = http.client.HTTPConnection(host,port,timeout=self.timeout)
+      conn.sock = sock
+      self._conn = conn
+      self._conn_key = (scheme,host,port)
+      return conn
+
+    self.dns.invalidate(host,port)   # all addresses failed, resolve again next time
+    raise last_err or OSError('no address of %s' % host)
+
+  def _request(self, url):
+    parts = urlsplit(url)
+    scheme = parts.scheme
+    host = parts.hostname
+    port = parts.port or (443 if scheme == 'https' else 80)
+    path = parts.path or '/'
+    if parts.query: path += '?' + parts.query
+
+    for i in range(2):   # retry once when kept-alive connection was closed by server
+      reused = bool(self._conn and self._conn.sock and self._conn_key == (scheme,host,port))
+      if reused:
+        conn = self._conn
+      else:
+        self._close()
+        conn = self._open(scheme,host,port)
+
+      try:
+        conn.request('GET',path,headers={'Host':parts.netloc.rpartition('@')[2]})
+        res = conn.getresponse()
+        if self._tls_sock:   # TLS 1.3 ticket arrives after handshake, it is read with response head
+          self._sessions[(host,port)] = self._tls_sock.session
+        body = res.read()
+      except (OSError,http.client.HTTPException):
+        self._close()
+        if reused: continue
+        raise
+
+      if reused: self.reused += 1
+      if res.will_close: self._close()
+      return res.status, body
+    return 0, b''
+
+  def query(self, url):   # blocking, return (ip,port) or None
+    with self._lock:
+      try:
+        status, body = self._request(url)
+        b = body[:64].split(b',')
+        if status == 200 and len(b) >= 3 and b[0] == b'OK':
+          server = (b[1].decode('utf-8'),int(b[2]))
+          self.ok += 1
+          self.updated = int(time.time())
+          if server != self.server:
+            logger.info('suo5 server discovered: %s:%i',*server)
+            self.server = server
+          self._save(url)
+          return server
+        logger.warning('discover suo5 server failed: status=%i, body=%r',status,body[:64])
+      except (OSError,ValueError,http.client.HTTPException) as e:
+        logger.warning('discover suo5 server failed: %s',e)
+      self.failed += 1
+      return None
+
+  def stats(self):
+    return { 'server': '%s:%i' % self.server if self.server else '', 'updated': self.updated,
+      'ok': self.ok, 'failed': self.failed, 'conn_reused': self.reused, 'tls_resumed': self.resumed,
+      'dns_hits': self.dns.hits, 'dns_misses': self.dns.misses }
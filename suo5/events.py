@@ -0,0 +1,108 @@
+# events.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import json, traceback
+from collections import deque
+from threading import Lock
+
+from twisted.internet import reactor, task
+from twisted.web.server import NOT_DONE_YET
+
+class _Subscriber:   # bounded queue of one subscriber, flushed in reactor thread
+  def __init__(self, size, on_items):
+    self.items = deque(maxlen=size)
+    self.on_items = on_items   # on_items([(event,data), ...]) called in reactor thread
+    self._scheduled = False
+    self._lock = Lock()
+
+  def put(self, item):   # return True when the oldest one is dropped
+    with self._lock:
+      dropped = len(self.items) == self.items.maxlen
+      self.items.append(item)
+      if self._scheduled: return dropped
+      self._scheduled = True
+    reactor.callFromThread(self._flush)
+    return dropped
+
+  def _flush(self):
+    with self._lock:
+      items = list(self.items)
+      self.items.clear()
+      self._scheduled = False
+    try:
+      self.on_items(items)
+    except:
+      logger.warning(traceback.format_exc())
+
+class EventHub:   # publish events to subscribers, each one has a bounded queue
+  def __init__(self, max_subscribers=16, queue_size=16):
+    self.max_subscribers = max_subscribers
+    self.queue_size = queue_size
+    self.dropped = 0
+    self._subs = []
+    self._lock = Lock()
+
+  @property
+  def subscribers(self):
+    return len(self._subs)
+
+  def subscribe(self, on_items):
+    with self._lock:
+      if len(self._subs) >= self.max_subscribers: return None
+      sub = _Subscriber(self.queue_size,on_items)
+      self._subs.append(sub)
+      return sub
+
+  def unsubscribe(self, sub):
+    with self._lock:
+      if sub in self._subs: self._subs.remove(sub)
+
+  def publish(self, event, data):   # can be called in any thread
+    with self._lock:
+      subs = self._subs[:]
+
+    item = (event,data)
+    for sub in subs:
+      if sub.put(item):   # slow subscriber, the oldest one dropped
+        self.dropped += 1
+
+def sse_format(event, data):
+  return 'event: %s\ndata: %s\n\n' % (event,json.dumps(data,separators=(',',':')))
+
+def sse_render(hub, request, first_event=None, keepalive=15):
+  # answer twisted request in reactor thread, an idle stream holds no WSGI thread, return NOT_DONE_YET or error body
+  finished = []
+  def write(items):
+    if not finished:
+      request.write(''.join(sse_format(*item) for item in items).encode('utf-8'))
+
+  sub = hub.subscribe(write)
+  if sub is None:
+    request.setResponseCode(503)   # client should fallback to polling
+    request.setHeader(b'Content-Type',b'text/plain')
+    return b'TOO_MANY_SUBSCRIBERS'
+
+  request.setHeader(b'Content-Type',b'text/event-stream')
+  request.setHeader(b'Cache-Control',b'no-cache')
+  request.setHeader(b'X-Accel-Buffering',b'no')
+  if request.method == b'HEAD':
+    hub.unsubscribe(sub)
+    return b''
+
+  ping = task.LoopingCall(lambda: finished or request.write(b': ping\n\n'))   # also detect disconnected client
+  def on_finish(_):
+    finished.append(True)
+    hub.unsubscribe(sub)
+    if ping.running: ping.stop()
+  request.notifyFinish().addBoth(on_finish)
+
+  request.write(b'retry: 3000\n\n')
+  if first_event:
+    try:
+      write([first_event()])
+    except:
+      logger.warning(traceback.format_exc())
+  ping.start(keepalive,now=False)
+  return NOT_DONE_YET
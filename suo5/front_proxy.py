@@ -0,0 +1,103 @@
+# front_proxy.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import asyncio, time
+
+from .metrics import Histogram
+
+class Backend:
+  def __init__(self, name, port, proc=None, host='127.0.0.1'):
+    self.name = name
+    self.addr = (host,port)
+    self.proc = proc         # Supervisor of the suo5 client that listening at addr
+    self.args = None         # command line of the client
+    self.output = None       # fn(stream,line) for output lines of the client
+    self.active = 0          # number of active connections
+    self.total = 0
+    self.bytes_up = 0        # client --> suo5 client
+    self.bytes_down = 0
+    self.healthy = True
+
+  def __repr__(self):
+    return '<Backend %s %s:%s active=%i>' % (self.name,self.addr[0],self.addr[1],self.active)
+
+async def _pipe(reader, writer, bk, is_up):
+  try:
+    while True:
+      data = await reader.read(65536)
+      if not data: break
+      if is_up:    # counters only changed in loop thread, no lock needed
+        bk.bytes_up += len(data)
+      else: bk.bytes_down += len(data)
+      writer.write(data)
+      await writer.drain()
+    if writer.can_write_eof():
+      writer.write_eof()
+  except (ConnectionError,OSError):
+    writer.close()
+
+class FrontProxy:   # forward client connections to suo5 client, new connection always goes to current backends
+  def __init__(self, connect_timeout=5):
+    self.connect_timeout = connect_timeout
+    self.backends = []       # current using backends, replaced as a whole when switching
+    self.connect_latency = Histogram()
+    self.connect_failures = 0
+    self.no_backend = 0
+    self._server = None
+
+  async def listen(self, host, port):
+    self._server = await asyncio.start_server(self._handle,host or None,port,reuse_address=True)
+    logger.info('front proxy listen at %s:%s',host,port)
+
+  async def close(self):
+    if self._server:
+      self._server.close()
+      await self._server.wait_closed()
+      self._server = None
+
+  def switch(self, backends):
+    self.backends = list(backends)
+    logger.info('front proxy switch to %s',self.backends)
+
+  def pick(self):   # least active connections first, try unhealthy ones when no other choice
+    ret = None
+    for bk in self.backends:
+      if ret is None or (bk.healthy,-bk.active) > (ret.healthy,-ret.active):
+        ret = bk
+    return ret
+
+  def wait_drained(self, backends, timeout):   # called from non-loop thread
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+      if not any(bk.active for bk in backends): return True
+      time.sleep(0.5)
+    return False
+
+  async def _handle(self, reader, writer):
+    bk = self.pick()
+    if bk is None:
+      self.no_backend += 1
+      writer.close()
+      return
+
+    bk.active += 1; bk.total += 1
+    try:
+      start = time.perf_counter()
+      try:
+        up_reader, up_writer = await asyncio.wait_for(asyncio.open_connection(*bk.addr),self.connect_timeout)
+      except (asyncio.TimeoutError,OSError) as e:
+        self.connect_failures += 1
+        logger.info('connect to %s failed: %s',bk,e)
+        writer.close()
+        return
+      self.connect_latency.observe(time.perf_counter() - start)
+
+      try:
+        await asyncio.gather(_pipe(reader,up_writer,bk,True),_pipe(up_reader,writer,bk,False))
+      finally:
+        up_writer.close()
+        writer.close()
+    finally:
+      bk.active -= 1
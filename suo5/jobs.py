@@ -0,0 +1,77 @@
+# jobs.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os, time, traceback
+from binascii import hexlify
+from collections import OrderedDict
+from queue import Queue
+from threading import Thread, Lock
+
+class Job:
+  def __init__(self, kind, fn, args):
+    self.id = hexlify(os.urandom(6)).decode('utf-8')
+    self.kind = kind
+    self.fn = fn
+    self.args = args
+    self.state = 'queued'   # queued, running, done, failed
+    self.error = ''
+    self.created = time.time()
+    self.started = 0
+    self.finished = 0
+
+  def info(self):
+    return { 'id': self.id, 'kind': self.kind, 'state': self.state, 'error': self.error,
+      'created': int(self.created), 'queued_ms': int(((self.started or time.time()) - self.created) * 1000),
+      'run_ms': int(((self.finished or time.time()) - self.started) * 1000) if self.started else 0 }
+
+class JobQueue:   # run control actions in own threads, so WSGI threads return at once
+  def __init__(self, workers=2, keep=64):
+    self.workers = workers
+    self.keep = keep           # max number of jobs remembered
+    self._jobs = OrderedDict() # {id: Job}
+    self._queue = Queue()
+    self._threads = []
+    self._lock = Lock()
+
+  def submit(self, kind, fn, *args):   # same kind of job that still in queue is reused
+    with self._lock:
+      for job in self._jobs.values():
+        if job.kind == kind and job.state == 'queued' and job.args == args:
+          return job
+
+      job = Job(kind,fn,args)
+      self._jobs[job.id] = job
+      self._evict()
+      if len(self._threads) < self.workers:
+        th = Thread(target=self._run,name='JobWorker-%i' % (len(self._threads)+1))
+        th.daemon = True
+        th.start()
+        self._threads.append(th)
+
+    self._queue.put(job)
+    return job
+
+  def get(self, job_id):
+    return self._jobs.get(job_id)
+
+  def _evict(self):   # forget oldest finished jobs
+    over = len(self._jobs) - self.keep
+    for job_id in [j.id for j in self._jobs.values() if j.finished][:max(0,over)]:
+      del self._jobs[job_id]
+
+  def _run(self):
+    while True:
+      job = self._queue.get()
+      job.state = 'running'
+      job.started = time.time()
+      try:
+        ok = job.fn(*job.args)
+        job.state = 'failed' if ok is False else 'done'
+      except Exception as e:
+        logger.warning(traceback.format_exc())
+        job.state = 'failed'
+        job.error = str(e)
+      job.finished = time.time()
+      logger.info('job %s (%s) %s in %.1fs',job.id,job.kind,job.state,job.finished - job.started)
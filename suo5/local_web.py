@@ -2,7 +2,7 @@
 
 import os
 
-from .dapp_http import _app as app
+from .dapp_http import _app as app, _flask_site
 assert app is not None, 'please call dapp_http.config_http() first'
 
 from . import runtime
@@ -52,3 +52,17 @@ def index_page():
 @app.route('/is_alive')
 def is_alive():
   return _is_alive()
+
+@app.route('/startup')
+def startup_report():   # timing of startup phases
+  report = runtime.get('startup_report')
+  if not report: return ('NOT_FOUND',404)
+  return report()
+
+# GET and HEAD are answered in reactor thread, flask routes above still serve other methods
+def _native_is_alive(request):
+  request.setHeader(b'Content-Type',b'text/html; charset=utf-8')
+  return _is_alive().encode('utf-8')
+
+_flask_site.add_route('/is_alive',_native_is_alive)
+_flask_site.add_route('/favicon.ico',lambda request: _flask_site.static.render_GET(request,'favicon.ico'))
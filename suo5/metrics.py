@@ -0,0 +1,65 @@
+# metrics.py
+
+from bisect import bisect_left
+
+LATENCY_BOUNDS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)   # seconds
+
+class Histogram:   # buckets are pre-allocated, observe() takes no lock, only call it in one thread
+  def __init__(self, bounds=LATENCY_BOUNDS):
+    self.bounds = tuple(bounds)
+    self.counts = [0] * (len(self.bounds) + 1)   # last one is +Inf
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    self.counts[bisect_left(self.bounds,value)] += 1
+    self.sum += value
+    self.count += 1
+
+  def quantile(self, q):   # estimated by bucket upper bound
+    if not self.count: return 0
+    rank = q * self.count; acc = 0
+    for i, n in enumerate(self.counts):
+      acc += n
+      if acc >= rank:
+        return self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+    return self.bounds[-1]
+
+def _fmt_labels(labels):
+  if not labels: return ''
+  return '{' + ','.join('%s="%s"' % (k,str(v).replace('\\','\\\\').replace('"','\\"')) for k,v in labels) + '}'
+
+def _fmt_value(v):
+  if isinstance(v,bool): v = int(v)
+  if isinstance(v,float): return repr(v)
+  return str(v)
+
+def render_prometheus(samples):
+  # samples: [(name,type,help,[(labels,value), ...]), ...], value of histogram type is Histogram
+  lines = []
+  for name, typ, help_, items in samples:
+    lines.append('# HELP %s %s' % (name,help_))
+    lines.append('# TYPE %s %s' % (name,typ))
+    for labels, value in items:
+      labels = tuple(labels)
+      if typ == 'histogram':
+        acc = 0
+        for bound, n in zip(value.bounds + ('+Inf',),value.counts):
+          acc += n
+          lines.append('%s_bucket%s %i' % (name,_fmt_labels(labels + (('le',bound),)),acc))
+        lines.append('%s_sum%s %s' % (name,_fmt_labels(labels),repr(value.sum)))
+        lines.append('%s_count%s %i' % (name,_fmt_labels(labels),value.count))
+      else: lines.append('%s%s %s' % (name,_fmt_labels(labels),_fmt_value(value)))
+  return '\n'.join(lines) + '\n'
+
+class ProbeStats:   # shared by probers, only updated in asyncio loop thread
+  def __init__(self):
+    self.ok = 0
+    self.failed = 0
+    self.latency = Histogram()
+
+  def record(self, ok, seconds):
+    if ok:
+      self.ok += 1
+    else: self.failed += 1
+    self.latency.observe(seconds)
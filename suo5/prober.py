@@ -0,0 +1,218 @@
+# prober.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import asyncio, ssl, time, struct, ipaddress
+from urllib.parse import urlsplit
+
+from .aio_loop import call_soon
+
+class ProbeError(Exception): pass
+
+def local_addr(host_port):   # '0.0.0.0:49000' --> ('127.0.0.1',49000)
+  host, port = host_port.rsplit(':',maxsplit=1)
+  host = host.strip('[]')
+  if host in ('','0.0.0.0'): host = '127.0.0.1'
+  elif host == '::': host = '::1'
+  return (host,int(port))
+
+def _socks5_addr(host):
+  try:
+    ip = ipaddress.ip_address(host)
+    if ip.version == 4:
+      return b'\x01' + ip.packed
+    else: return b'\x04' + ip.packed
+  except ValueError:   # take as domain name, let proxy resolve it (same as socks5h)
+    b = host.encode('idna')
+    return b'\x03' + bytes((len(b),)) + b
+
+async def socks5_connect(proxy, host, port, auth='', timeout=10):
+  reader, writer = await asyncio.wait_for(asyncio.open_connection(proxy[0],proxy[1]),timeout)
+  try:
+    if auth:
+      writer.write(b'\x05\x02\x00\x02')
+    else: writer.write(b'\x05\x01\x00')
+    ver, method = await asyncio.wait_for(reader.readexactly(2),timeout)
+    if ver != 5:
+      raise ProbeError('invalid socks5 version')
+
+    if method == 0x02:    # username/password sub-negotiation, RFC 1929
+      if not auth: raise ProbeError('socks5 authentication required')
+      user, psw = auth.split(':',maxsplit=1)
+      user = user.encode('utf-8'); psw = psw.encode('utf-8')
+      writer.write(b'\x01' + bytes((len(user),)) + user + bytes((len(psw),)) + psw)
+      b = await asyncio.wait_for(reader.readexactly(2),timeout)
+      if b[1] != 0: raise ProbeError('socks5 authentication failed')
+    elif method != 0x00:
+      raise ProbeError('socks5 no acceptable method')
+
+    writer.write(b'\x05\x01\x00' + _socks5_addr(host) + struct.pack('>H',port))
+    b = await asyncio.wait_for(reader.readexactly(4),timeout)
+    if b[1] != 0:
+      raise ProbeError('socks5 connect failed, rep=%i' % b[1])
+
+    atyp = b[3]     # skip bound address
+    if atyp == 1:
+      n = 4
+    elif atyp == 4:
+      n = 16
+    else: n = (await asyncio.wait_for(reader.readexactly(1),timeout))[0]
+    await asyncio.wait_for(reader.readexactly(n+2),timeout)
+    return (reader,writer)
+
+  except:
+    writer.close()
+    raise
+
+async def read_response(reader, timeout, max_body=4096):
+  head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),timeout)
+  lines = head.decode('latin-1').split('\r\n')
+  b = lines[0].split(' ',maxsplit=2)
+  if len(b) < 2 or b[0][:5] != 'HTTP/':
+    raise ProbeError('invalid http response')
+  status = int(b[1])
+
+  headers = {}
+  for ln in lines[1:]:
+    if ':' in ln:
+      k, v = ln.split(':',maxsplit=1)
+      headers[k.strip().lower()] = v.strip()
+  keep_alive = headers.get('connection','').lower() != 'close' and b[0] != 'HTTP/1.0'
+
+  if headers.get('transfer-encoding','').lower() == 'chunked':
+    body = b''
+    while True:
+      size = int((await asyncio.wait_for(reader.readline(),timeout)).split(b';')[0],16)
+      chunk = await asyncio.wait_for(reader.readexactly(size+2),timeout)
+      if size == 0: break
+      body += chunk[:-2]
+      if len(body) > max_body:
+        keep_alive = False
+        break
+  elif 'content-length' in headers:
+    size = int(headers['content-length'])
+    if size > max_body:
+      keep_alive = False
+      body = await asyncio.wait_for(reader.readexactly(max_body),timeout)
+    else: body = await asyncio.wait_for(reader.readexactly(size),timeout)
+  else:
+    keep_alive = False
+    body = await asyncio.wait_for(reader.read(max_body),timeout)
+
+  return (status,body,keep_alive)
+
+class Suo5Prober:
+  def __init__(self, timeout=10, stats=None):
+    self.timeout = timeout
+    self.stats = stats       # metrics.ProbeStats or None
+    self.proxy = None        # (host,port) of local suo5 client
+    self.target_url = ''
+    self.auth = ''           # 'user:password' or ''
+    self.last_attempts = []  # [(ok,latency_ms,error), ...] of the last probe()
+
+    self._conn = None        # kept-alive (reader,writer) through the tunnel
+    self._stale = False
+    self._gen = 0            # bumped by reset(), connection of older generation is not kept
+    self._ssl_ctx = None
+
+  def config(self, local_host, target_url, auth=''):
+    proxy = local_addr(local_host)
+    if proxy != self.proxy or target_url != self.target_url or auth != self.auth:
+      self.proxy = proxy
+      self.target_url = target_url
+      self.auth = auth
+      self._stale = True    # kept-alive connection will be dropped in loop thread
+
+  def _drop_conn(self):
+    conn = self._conn
+    self._conn = None
+    self._stale = False
+    if conn: conn[1].close()
+
+  def _reset(self):
+    self._gen += 1
+    self._drop_conn()
+
+  def reset(self):   # drop kept-alive connection at once, such as front proxy switched to other backends
+    call_soon(self._reset)
+
+  async def _open(self, host, port, is_https):
+    reader, writer = await socks5_connect(self.proxy,host,port,self.auth,self.timeout)
+    if is_https:
+      if self._ssl_ctx is None:
+        self._ssl_ctx = ssl.create_default_context()   # verify certificate as curl does, user agent carries credential
+      await asyncio.wait_for(writer.start_tls(self._ssl_ctx,server_hostname=host),self.timeout)
+    return (reader,writer)
+
+  async def _request(self, user_agent):
+    url = urlsplit(self.target_url)
+    is_https = url.scheme == 'https'
+    host = url.hostname
+    port = url.port or (443 if is_https else 80)
+    path = url.path or '/'
+    if url.query: path += '?' + url.query
+
+    host_hdr = host if url.port is None else '%s:%i' % (host,url.port)
+    data = ('GET %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\nAccept: */*\r\nConnection: keep-alive\r\n\r\n' % (path,host_hdr,user_agent)).encode('utf-8')
+
+    if self._stale: self._drop_conn()
+    conn = self._conn; self._conn = None
+    if conn and conn[0].at_eof():
+      conn[1].close(); conn = None
+
+    reused = conn is not None
+    gen = self._gen
+    while True:
+      if conn is None:
+        conn = await self._open(host,port,is_https)
+
+      reader, writer = conn
+      try:
+        writer.write(data)
+        await writer.drain()
+        status, body, keep_alive = await read_response(reader,self.timeout)
+      except (ConnectionError,asyncio.IncompleteReadError):
+        writer.close()
+        if reused:    # kept-alive connection may be closed by peer, retry with new one
+          reused = False; conn = None
+          continue
+        raise
+      except:
+        writer.close()
+        raise
+
+      if keep_alive and gen == self._gen:   # not reset while requesting
+        self._conn = conn
+      else: writer.close()
+      return body
+
+  async def probe_once(self, user_agent):
+    start = time.perf_counter()
+    err = ''
+    try:
+      body = await self._request(user_agent)
+      ok = body[:2] == b'OK'
+      if not ok: err = 'unexpected response'
+    except asyncio.TimeoutError:
+      ok = False; err = 'timeout'
+    except (ProbeError,OSError,ValueError,asyncio.IncompleteReadError,asyncio.LimitOverrunError) as e:
+      ok = False; err = str(e) or e.__class__.__name__
+    
+    elapsed = time.perf_counter() - start
+    if self.stats: self.stats.record(ok,elapsed)
+    return (ok,int(elapsed * 1000),err)
+
+  async def probe(self, user_agent, tries=3, retry_delay=1):
+    attempts = []
+    try:
+      for i in range(tries):
+        if i and retry_delay: await asyncio.sleep(retry_delay)
+        ret = await self.probe_once(user_agent)
+        attempts.append(ret)
+        if ret[0]: return True
+      return False
+    finally:
+      self.last_attempts = attempts
+      if attempts and not attempts[-1][0]:
+        logger.info('suo5 probe failed: %s',attempts)
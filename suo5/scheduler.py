@@ -0,0 +1,128 @@
+# scheduler.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import time, random, heapq, traceback
+from collections import deque
+from threading import Thread, Condition
+
+class _Task:
+  def __init__(self, name, fn, interval, retry_min, retry_max, jitter):
+    self.name = name
+    self.fn = fn
+    self.interval = interval
+    self.retry_min = retry_min
+    self.retry_max = retry_max
+    self.jitter = jitter
+
+    self.seq = 0          # sequence of the latest scheduled timer, older timers are ignored
+    self.due = 0          # monotonic time of next running
+    self.fails = 0        # continuous failed times
+    self.last_run = 0     # wall time of last running
+    self.last_ok = None
+
+  def next_delay(self):
+    if self.fails:        # exponential backoff after failure
+      delay = min(self.retry_min * (2 ** (self.fails - 1)),self.retry_max)
+    else:
+      delay = self.interval
+      if not delay: return None   # only run when triggered
+    if self.jitter:
+      delay *= random.uniform(1 - self.jitter,1 + self.jitter)
+    return delay
+
+class Scheduler(Thread):
+  def __init__(self, name='Scheduler'):
+    Thread.__init__(self,name=name)
+    self.daemon = True
+    self._active = True
+    self._cond = Condition()
+    self._tasks = {}
+    self._timers = []         # heap of (due,seq,name)
+    self._triggers = deque()  # task names that should run right now
+
+  def add_task(self, name, fn, interval, first_delay=None, retry_min=5, retry_max=None, jitter=0.1):
+    # fn() return False or raise exception means failure, others means success
+    # interval=None means the task only runs when triggered (or retried after failure)
+    task = _Task(name,fn,interval,retry_min,retry_max or interval or 300,jitter)
+    with self._cond:
+      self._tasks[name] = task
+      self._schedule(task,interval if first_delay is None else first_delay)
+      self._cond.notify()
+    return task
+
+  def set_interval(self, name, interval, retry_min=None, retry_max=None):
+    with self._cond:
+      task = self._tasks[name]
+      task.interval = interval
+      if retry_min is not None: task.retry_min = retry_min
+      if retry_max is not None: task.retry_max = retry_max
+      if not task.fails:
+        self._schedule(task,interval)
+        self._cond.notify()
+
+  def trigger(self, name):
+    with self._cond:
+      if name in self._tasks and name not in self._triggers:
+        self._triggers.append(name)
+        self._cond.notify()
+
+  def task_state(self, name):
+    task = self._tasks.get(name)
+    if not task: return None
+    return { 'interval': task.interval, 'fails': task.fails, 'last_ok': task.last_ok,
+      'last_run': int(task.last_run), 'next_in': max(0,int(task.due - time.monotonic())) if task.due else None }
+
+  def exit(self):   # return at once, running task (if has) will finish in background
+    with self._cond:
+      self._active = False
+      self._cond.notify()
+
+  def _schedule(self, task, delay):
+    task.seq += 1
+    if delay is None:
+      task.due = 0
+      return
+    task.due = time.monotonic() + delay
+    heapq.heappush(self._timers,(task.due,task.seq,task.name))
+
+  def _next_task(self):
+    with self._cond:
+      while self._active:
+        if self._triggers:
+          return self._tasks[self._triggers.popleft()]
+
+        if self._timers:
+          due, seq, name = self._timers[0]
+          task = self._tasks[name]
+          if seq != task.seq:    # outdated timer
+            heapq.heappop(self._timers)
+            continue
+
+          wait = due - time.monotonic()
+          if wait <= 0:
+            heapq.heappop(self._timers)
+            return task
+          self._cond.wait(wait)
+        else: self._cond.wait()
+    return None
+
+  def run(self):
+    while True:
+      task = self._next_task()
+      if task is None: break
+
+      task.last_run = time.time()
+      try:
+        ok = task.fn() is not False
+      except:
+        logger.warning(traceback.format_exc())
+        ok = False
+
+      with self._cond:
+        task.last_ok = ok
+        task.fails = 0 if ok else task.fails + 1
+        self._schedule(task,task.next_delay())
+
+    logger.info('%s thread exited',self.name)
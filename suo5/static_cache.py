@@ -0,0 +1,259 @@
+# static_cache.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os, re, gzip, hashlib, mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+
+_COMPRESSIBLE = ('text/','application/javascript','application/json','image/svg+xml','application/xml')
+_FINGERPRINT = re.compile(r'[.\-_][0-9a-f]{8,}\.[^/]+$')   # such as app.1a2b3c4d.js
+
+mimetypes.add_type('text/markdown','.md')
+
+class _Entry:   # only stat at first, content and gzip variant are loaded by load() in loader thread
+  def __init__(self, path, st):
+    self.path = path
+    self.stamp = (st.st_mtime_ns,st.st_size)
+    self.mtime = formatdate(st.st_mtime,usegmt=True)
+    ctype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if ctype.startswith('text/') or ctype == 'application/javascript':
+      ctype += '; charset=utf-8'
+    self.ctype = ctype
+    self.immutable = bool(_FINGERPRINT.search(path))
+
+    self.loaded = False
+    self.waiters = None   # [fn(ok), ...] while loading
+    self.data = None
+    self.hash = self.etag = ''
+    self.variants = {}    # {encoding: bytes}, only keep ones smaller enough
+
+  def load(self):   # blocking, not called in reactor thread
+    with open(self.path,'rb') as f:
+      data = f.read()   # bytes is served as is, no copy per request
+
+    variants = {}
+    if len(data) >= 256 and self.ctype.startswith(_COMPRESSIBLE):
+      b = gzip.compress(data,9,mtime=0)
+      if len(b) < len(data) * 0.9: variants['gzip'] = b
+
+    self.hash = hashlib.sha256(data).hexdigest()[:16]
+    self.etag = '"%s"' % self.hash
+    self.data = data
+    self.variants = variants
+    self.loaded = True
+
+class StaticCache:   # files and their compressed variants, loaded on first request
+  def __init__(self, root):
+    self.root = os.path.abspath(root)
+    self._entries = {}   # {relative_path: _Entry}
+    self.hits = 0
+    self.not_modified = 0
+    self.loads = 0
+    self._pool = None    # one loader thread, not taking WSGI threads of reactor pool
+
+  def build(self):   # only scan, so starting is not slowed down by reading and compressing
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(self.root):
+      dirnames[:] = [d for d in dirnames if d[:1] != '.']
+      for name in filenames:
+        if name[:1] == '.': continue
+        path = os.path.join(dirpath,name)
+        rel = os.path.relpath(path,self.root).replace(os.sep,'/')
+        try:
+          entry = self._entries[rel] = _Entry(path,os.stat(path))
+          size += entry.stamp[1]
+        except OSError as e:
+          logger.warning('cache %s failed: %s',rel,e)
+    logger.info('static cache: %i files, %i KB',len(self._entries),size // 1024)
+    return self
+
+  def __contains__(self, rel):
+    return rel in self._entries
+
+  def get(self, rel):   # return None when not found, a new entry (not loaded) replaces the changed one
+    entry = self._entries.get(rel)
+    if entry is None: return None
+
+    try:
+      st = os.stat(entry.path)
+      if (st.st_mtime_ns,st.st_size) != entry.stamp:
+        entry = self._entries[rel] = _Entry(entry.path,st)
+    except OSError:
+      self._entries.pop(rel,None)
+      return None
+    return entry
+
+  def load(self, entry, callback):   # load entry in loader thread, callback(ok) in reactor thread
+    if entry.waiters is None:
+      entry.waiters = [callback]
+      self.loads += 1
+      if self._pool is None:
+        self._pool = ThreadPoolExecutor(1,'StaticLoader')
+        reactor.addSystemEventTrigger('before','shutdown',self._pool.shutdown,False)
+      fut = self._pool.submit(entry.load)
+      fut.add_done_callback(lambda f: reactor.callFromThread(self._on_loaded,f.exception(),entry))
+    else: entry.waiters.append(callback)   # requests of same file share one loading
+
+  def _on_loaded(self, err, entry):
+    ok = err is None
+    if not ok: logger.warning('cache %s failed: %s',entry.path,err)
+    waiters, entry.waiters = entry.waiters, None
+    for fn in waiters: fn(ok)
+
+def _parse_range(value, size):   # only single range is supported, return (start,end) or None
+  if not value.startswith('bytes=') or ',' in value: return None
+  start, _, end = value[6:].strip().partition('-')
+  try:
+    if not start:    # suffix: bytes=-500
+      n = int(end)
+      return (max(0,size - n),size - 1) if n > 0 else False
+    start = int(start)
+    end = min(int(end),size - 1) if end else size - 1
+  except ValueError:
+    return None
+  if start >= size or start > end: return False   # not satisfiable
+  return (start,end)
+
+def _accepted(header):   # set of acceptable content-coding
+  ret = set()
+  for item in header.split(','):
+    name, _, params = item.strip().partition(';')
+    if params.replace(' ','') in ('q=0','q=0.0','q=0.00','q=0.000'): continue
+    ret.add(name.strip().lower())
+  return ret
+
+class StaticResource(Resource):   # serve StaticCache in reactor thread, no WSGI thread needed
+  isLeaf = True
+
+  def __init__(self, cache):
+    Resource.__init__(self)
+    self.cache = cache
+
+  def render_GET(self, request, rel=None):
+    if rel is None: rel = '/'.join(s.decode('utf-8') for s in request.postpath)
+    entry = self.cache.get(rel)
+    if entry is None:
+      request.setResponseCode(404)
+      return b'Not Found'
+    if entry.loaded: return self._render(request,entry)
+
+    finished = []
+    request.notifyFinish().addBoth(finished.append)   # client may go away while loading
+    def on_loaded(ok):
+      if finished: return
+      if ok:
+        body = self._render(request,entry)
+      else:
+        request.setResponseCode(404)
+        body = b'Not Found'
+      if request.code != 304: request.setHeader(b'Content-Length',b'%i' % len(body))
+      request.write(body)
+      request.finish()
+    self.cache.load(entry,on_loaded)
+    return NOT_DONE_YET
+
+  def _render(self, request, entry):
+    self.cache.hits += 1
+    header = lambda name: (request.getHeader(name) or b'').decode('latin-1')
+    version = request.args.get(b'v',[b''])[0].decode('utf-8','ignore')
+    if entry.immutable or (version and entry.hash.startswith(version)):
+      request.setHeader(b'Cache-Control',b'public, max-age=31536000, immutable')
+    else: request.setHeader(b'Cache-Control',b'no-cache')   # revalidate by ETag
+    request.setHeader(b'ETag',entry.etag)
+    request.setHeader(b'Last-Modified',entry.mtime)
+    request.setHeader(b'Vary',b'Accept-Encoding')
+    request.setHeader(b'Accept-Ranges',b'bytes')
+    request.setHeader(b'Content-Type',entry.ctype)
+
+    # step 1: conditional GET
+    inm = header(b'if-none-match')
+    if inm:
+      not_modified = inm.strip() == '*' or entry.etag in [s.strip().replace('W/','') for s in inm.split(',')]
+    else:
+      not_modified = False
+      ims = header(b'if-modified-since')
+      if ims:
+        try:
+          not_modified = parsedate_to_datetime(ims) >= parsedate_to_datetime(entry.mtime)
+        except (TypeError,ValueError): pass
+    if not_modified:
+      self.cache.not_modified += 1
+      request.setResponseCode(304)
+      return b''
+
+    # step 2: range request, always on identity content
+    rng = header(b'range')
+    if rng:
+      if_range = header(b'if-range')
+      if if_range and if_range.strip() not in (entry.etag,entry.mtime): rng = None
+    if rng:
+      size = len(entry.data)
+      rng = _parse_range(rng,size)
+      if rng is False:
+        request.setResponseCode(416)
+        request.setHeader(b'Content-Range','bytes */%i' % size)
+        return b''
+      if rng:
+        request.setResponseCode(206)
+        request.setHeader(b'Content-Range','bytes %i-%i/%i' % (rng[0],rng[1],size))
+        return entry.data[rng[0]:rng[1] + 1]
+
+    # step 3: choose precompressed variant
+    if entry.variants:
+      accepted = _accepted(header(b'accept-encoding'))
+      if 'gzip' in accepted and 'gzip' in entry.variants:
+        request.setHeader(b'Content-Encoding',b'gzip')
+        return entry.variants['gzip']
+    return entry.data
+
+  render_HEAD = render_GET
+
+class FrontResource(Resource):   # answer static files and simple routes natively, pass others to WSGI resource
+  isLeaf = True
+
+  def __init__(self, wsgi_res, cache, static_url):
+    Resource.__init__(self)
+    self.wsgi_res = wsgi_res
+    self.static = StaticResource(cache)
+    # localhost_main mounts at /<APP_NAME>/ with static_url '/static', root_main sees full path with '/<APP_NAME>/static'
+    self.prefix = [s.encode('utf-8') for s in static_url.strip('/').split('/')]
+    self.app_prefix = self.prefix[:-1]
+    self.routes = {}       # {path_tuple: fn(request)}
+    self.native = 0        # number of requests answered in reactor thread
+    self.passed = 0
+
+  def add_route(self, rule, fn):   # fn(request) returns bytes, only GET and HEAD are routed
+    self.routes[tuple(rule.strip('/').encode('utf-8').split(b'/'))] = fn
+
+  def _static_path(self, path):
+    n = len(self.prefix)
+    if len(path) > n and path[:n] == self.prefix:
+      try:
+        rel = '/'.join(s.decode('utf-8') for s in path[n:])
+      except UnicodeDecodeError:
+        return None
+      if rel in self.static.cache: return rel
+    return None
+
+  def render(self, request):
+    if request.method in (b'GET',b'HEAD'):
+      path = request.postpath
+      n = len(self.app_prefix)
+      fn = self.routes.get(tuple(path[n:])) if path[:n] == self.app_prefix else None
+      if fn:
+        self.native += 1
+        return fn(request)
+
+      rel = self._static_path(path)
+      if rel is not None:
+        self.native += 1
+        return self.static.render_GET(request,rel)
+
+    self.passed += 1
+    return self.wsgi_res.render(request)
@@ -0,0 +1,224 @@
+# supervisor.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os, time, signal, select, subprocess, traceback
+from threading import Thread, Timer, Event, Lock
+
+def find_orphans(pattern, fallback_cmd='', exclude=()):  # find processes whose command line contains pattern
+  if isinstance(pattern,str): pattern = (pattern,)       # pattern can be tuple, all items should be matched
+  pattern = [s.encode('utf-8') for s in pattern]
+  if os.path.isdir('/proc/self'):
+    ret = []
+    my_pid = os.getpid()
+    for item in os.listdir('/proc'):
+      if not item.isdigit(): continue
+      pid = int(item)
+      if pid == my_pid or pid in exclude: continue
+      try:
+        with open('/proc/%s/cmdline' % item,'rb') as f:
+          cmdline = f.read()
+      except OSError: continue
+      cmdline = cmdline.replace(b'\0',b' ')   # same as 'ps -ef | grep'
+      if all(cmdline.find(s) >= 0 for s in pattern):
+        ret.append(pid)
+    return ret
+
+  if fallback_cmd:   # no /proc, such as darwin
+    try:
+      b = os.popen(fallback_cmd).read().split()
+      pids = [int(s) for s in b if s.isdigit() and int(s) not in exclude and int(s) != os.getpid()]
+    except: return []
+    # fallback_cmd lists every suo5 client, keep ones whose command line matches all items of pattern
+    return [pid for pid in pids if all(_ps_cmdline(pid).find(s) >= 0 for s in pattern)]
+  return []
+
+def _ps_cmdline(pid):   # command line by 'ps', b'' when process not found
+  try:
+    return subprocess.run(['ps','-ww','-o','command=','-p',str(pid)],stdin=subprocess.DEVNULL,
+      stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,timeout=5).stdout.strip()
+  except (OSError,subprocess.SubprocessError):
+    return b''
+
+def _pid_alive(pid):
+  try:
+    os.kill(pid,0)
+    return True
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+
+class Supervisor:
+  def __init__(self, name, pattern, fallback_cmd=''):
+    self.name = name
+    self.pattern = pattern            # such as 'suo5/suo5-' or ('suo5/suo5-','127.0.0.1:49001')
+    self.fallback_cmd = fallback_cmd  # shell command to list PIDs when /proc not available
+    self.restart_fn = None            # called when process exits unexpectedly
+    self.on_change = None             # called when process started or exited
+
+    self.pid = 0
+    self.started_at = 0
+    self.exit_code = None
+    self.starts = 0
+    self.restarts = 0
+    self.adopted = False   # is orphaned process, not our child
+
+    self._proc = None
+    self._exited = Event()
+    self._exited.set()
+    self._stopping = False
+    self._quick_fails = 0
+    self._restart_timer = None
+    self._lock = Lock()
+
+  @property
+  def running(self):
+    return not self._exited.is_set()
+
+  def state(self):
+    running = self.running
+    return { 'pid': self.pid if running else 0, 'running': running,
+      'uptime': int(time.time() - self.started_at) if running else 0,
+      'exit_code': self.exit_code, 'starts': self.starts, 'restarts': self.restarts }
+
+  def spawn(self, args, output=None, cwd=None, env=None, check_wait=1):
+    # output(stream,line) is called in reader threads for every line of stdout ('out') and stderr ('err')
+    with self._lock:
+      if self.running: return True
+      self._cancel_restart()
+
+      out = subprocess.PIPE if output else subprocess.DEVNULL
+      try:
+        proc = subprocess.Popen(args,stdin=subprocess.DEVNULL,stdout=out,stderr=out,
+          cwd=cwd,env=env,start_new_session=True)   # not killed by signals to our process group
+      except OSError as e:
+        logger.error('start %s failed: %s',self.name,e)
+        return False
+
+      if output:
+        for pipe, stream in ((proc.stdout,'out'),(proc.stderr,'err')):
+          th = Thread(target=self._read_pipe,args=(pipe,stream,output),name='%s-%s' % (self.name,stream))
+          th.daemon = True
+          th.start()
+      self._track(proc,proc.pid,False)
+      self.starts += 1
+
+    self._changed()
+    if self._exited.wait(check_wait):   # exited at once, such as invalid arguments
+      logger.warning('%s exited at once, code=%s',self.name,self.exit_code)
+      return False
+    return True
+
+  def adopt_orphans(self):   # track orphaned process that started by previous dapp process
+    pids = find_orphans(self.pattern,self.fallback_cmd)
+    with self._lock:
+      if self.running or not pids: return pids
+      self._track(None,pids[0],True)
+    logger.info('adopt orphaned %s process: %s',self.name,pids[0])
+    return pids
+
+  def stop(self, timeout=3, kill_orphans=True):
+    with self._lock:
+      self._cancel_restart()
+      self._stopping = True
+      pid = self.pid if self.running else 0
+
+    try:
+      if pid:
+        self._signal(pid,signal.SIGTERM)
+        if not self._exited.wait(timeout):
+          self._signal(pid,signal.SIGKILL)
+          self._exited.wait(timeout)
+
+      if kill_orphans:   # ensure only one client in running
+        for pid in find_orphans(self.pattern,self.fallback_cmd,(pid,)):
+          self._signal(pid,signal.SIGKILL)
+      return not self.running
+    finally:
+      self._stopping = False
+
+  def _read_pipe(self, pipe, stream, output):
+    try:
+      for line in iter(pipe.readline,b''):
+        try:
+          output(stream,line)
+        except:
+          logger.warning(traceback.format_exc())
+    except (OSError,ValueError): pass
+    finally: pipe.close()
+
+  def _changed(self):
+    if self.on_change:
+      try:
+        self.on_change()
+      except:
+        logger.warning(traceback.format_exc())
+
+  def _signal(self, pid, sig):
+    try:
+      os.kill(pid,sig)
+    except ProcessLookupError: pass
+
+  def _cancel_restart(self):
+    if self._restart_timer:
+      self._restart_timer.cancel()
+      self._restart_timer = None
+
+  def _track(self, proc, pid, adopted):
+    self._proc = proc
+    self.pid = pid
+    self.adopted = adopted
+    self.started_at = time.time()
+    self.exit_code = None
+    self._exited.clear()
+
+    th = Thread(target=self._wait_exit,args=(proc,pid),name=self.name+'-waiter')
+    th.daemon = True
+    th.start()
+
+  def _wait_exit(self, proc, pid):
+    code = None
+    try:
+      if proc:
+        code = proc.wait()      # also reap zombie
+      elif hasattr(os,'pidfd_open'):
+        fd = os.pidfd_open(pid)
+        try:
+          select.select([fd],[],[])
+        finally: os.close(fd)
+      else:
+        while _pid_alive(pid): time.sleep(2)
+    except ProcessLookupError: pass
+    except:
+      logger.warning(traceback.format_exc())
+      while _pid_alive(pid): time.sleep(2)
+
+    with self._lock:
+      if pid != self.pid: return
+      stopping = self._stopping     # read before notifying stop()
+      self.exit_code = code
+      self._proc = None
+      self._exited.set()
+
+      uptime = time.time() - self.started_at
+      logger.info('%s process %s exited, code=%s, uptime=%is',self.name,pid,code,uptime)
+      self._changed()
+      if stopping or not self.restart_fn: return
+
+      # unexpected exit, restart with backoff
+      self._quick_fails = self._quick_fails + 1 if uptime < 30 else 0
+      delay = min(2 ** self._quick_fails,60)
+      self._restart_timer = Timer(delay,self._restart)
+      self._restart_timer.daemon = True
+      self._restart_timer.start()
+
+  def _restart(self):
+    self._restart_timer = None
+    if self.running or not self.restart_fn: return
+    self.restarts += 1
+    try:
+      self.restart_fn()
+    except:
+      logger.warning(traceback.format_exc())
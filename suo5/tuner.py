@@ -0,0 +1,163 @@
+# tuner.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os, ssl, time, socket, asyncio, itertools, traceback
+from threading import Lock
+from urllib.parse import urlsplit
+
+from .aio_loop import run_sync
+from .prober import ProbeError, socks5_connect
+from .supervisor import Supervisor
+from .tunnel import wait_listening
+
+TUNE_OPTIONS = ('with_get_method','with_no_gzip','with_cookiejar')
+
+def spare_port(host='127.0.0.1'):   # a free port chosen by system
+  s = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+  try:
+    s.bind((host,0))
+    return s.getsockname()[1]
+  finally:
+    s.close()
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os,'sysconf') else 100
+
+def proc_cpu(pid):   # user + system CPU seconds of process, None when /proc not available
+  try:
+    with open('/proc/%i/stat' % pid,'rb') as f:
+      data = f.read()
+    b = data[data.rindex(b')') + 2:].split()   # fields after command name, 3rd field is state
+    return (int(b[11]) + int(b[12])) / _CLK_TCK
+  except (OSError,ValueError,IndexError):
+    return None
+
+def _median(items):
+  items = sorted(items)
+  return items[len(items) // 2] if items else None
+
+class Tuner:   # try every ex_opt combination with temporary suo5 clients, find the fastest one
+  def __init__(self, pattern='suo5/suo5-', timeout=10):
+    self.pattern = pattern
+    self.timeout = timeout
+    self.result = {'state': 'idle'}
+    self._ssl_ctx = None
+    self._lock = Lock()
+
+  @property
+  def running(self):
+    return self._lock.locked()
+
+  async def _fetch(self, proxy, url, auth, max_bytes):   # return (connect_seconds,body_bytes,transfer_seconds)
+    u = urlsplit(url)
+    is_https = u.scheme == 'https'
+    port = u.port or (443 if is_https else 80)
+    path = u.path or '/'
+    if u.query: path += '?' + u.query
+    host_hdr = u.hostname if u.port is None else '%s:%i' % (u.hostname,u.port)
+
+    start = time.perf_counter()
+    reader, writer = await socks5_connect(proxy,u.hostname,port,auth,self.timeout)
+    try:
+      connected = time.perf_counter()
+      if is_https:
+        if self._ssl_ctx is None:
+          self._ssl_ctx = ssl.create_default_context()   # verify certificate, same as prober
+        await asyncio.wait_for(writer.start_tls(self._ssl_ctx,server_hostname=u.hostname),self.timeout)
+      writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\nAccept: */*\r\nAccept-Encoding: identity\r\nConnection: close\r\n\r\n' % (path,host_hdr)).encode('utf-8'))
+      head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),self.timeout)
+      status = head.split(b' ',2)[1:2]
+      if not status or status[0][:1] not in (b'2',b'3'):
+        raise ProbeError('unexpected response: %s' % head.split(b'\r\n')[0].decode('latin-1'))
+
+      size = 0
+      while size < max_bytes:
+        data = await asyncio.wait_for(reader.read(65536),self.timeout)
+        if not data: break
+        size += len(data)
+      return (connected - start,size,time.perf_counter() - connected)
+    finally:
+      writer.close()
+
+  async def _measure(self, proxy, url, auth, rounds, max_bytes):
+    connects = []; speeds = []; errors = []; total = 0
+    for i in range(rounds):
+      try:
+        connect, size, elapsed = await self._fetch(proxy,url,auth,max_bytes)
+      except asyncio.TimeoutError:
+        errors.append('timeout')
+        continue
+      except (ProbeError,OSError,ValueError,asyncio.IncompleteReadError,asyncio.LimitOverrunError) as e:
+        errors.append(str(e) or e.__class__.__name__)
+        continue
+      connects.append(connect)
+      total += size
+      if elapsed > 0: speeds.append(size / elapsed)
+    return (connects,speeds,total,errors)
+
+  def _try(self, name, opt, make_args, url, auth, rounds, max_bytes):
+    port = spare_port()
+    listen = '127.0.0.1:%i' % port
+    proc = Supervisor(name,(self.pattern,listen))
+    last_err = []
+    def output(stream, line):
+      if stream == 'err': last_err[:] = [line.decode('utf-8','replace').strip()]
+
+    ret = {'opt': opt, 'ok': False}
+    try:
+      if not proc.spawn(make_args(listen,opt),output) or not wait_listening(('127.0.0.1',port),5,proc):
+        ret['error'] = last_err[0] if last_err else 'client not started'
+        return ret
+
+      cpu = proc_cpu(proc.pid)
+      start = time.perf_counter()
+      connects, speeds, total, errors = run_sync(self._measure(('127.0.0.1',port),url,auth,rounds,max_bytes),
+        timeout=(self.timeout * 3 + 5) * rounds)
+      elapsed = time.perf_counter() - start
+      cpu_end = proc_cpu(proc.pid)
+
+      ret.update(ok=bool(connects),rounds=rounds,fails=len(errors),bytes=total,
+        connect_ms=int(_median(connects) * 1000) if connects else None,
+        throughput_kbps=int(_median(speeds) * 8 / 1000) if speeds else None,
+        cpu_ms=int((cpu_end - cpu) * 1000) if cpu is not None and cpu_end is not None else None,
+        seconds=round(elapsed,2))
+      if errors: ret['error'] = errors[-1]
+      return ret
+    except:
+      logger.warning(traceback.format_exc())
+      ret['error'] = 'measure failed'
+      return ret
+    finally:
+      proc.stop(kill_orphans=False)
+
+  @staticmethod
+  def pick(results, tolerance=0.1):   # fastest one, among nearly fastest ones prefer less CPU and lower latency
+    ok = [r for r in results if r['ok']]
+    if not ok: return None
+    best = max(r['throughput_kbps'] or 0 for r in ok)
+    near = [r for r in ok if (r['throughput_kbps'] or 0) >= best * (1 - tolerance)]
+    return min(near,key=lambda r: (r['cpu_ms'] is None,r['cpu_ms'] or 0,r['connect_ms']))
+
+  def run(self, make_args, url, auth='', options=TUNE_OPTIONS, rounds=3, max_bytes=4*1024*1024):
+    # make_args(listen_host,opt) returns command line of suo5 client, opt is {option: bool}
+    if not self._lock.acquire(blocking=False): return None
+    try:
+      combos = [dict(zip(options,values)) for values in itertools.product((False,True),repeat=len(options))]
+      results = []
+      self.result = { 'state': 'running', 'target': url, 'started': int(time.time()),
+        'done': 0, 'total': len(combos), 'results': results }
+      for i, opt in enumerate(combos):
+        results.append(self._try('suo5-tune%i' % (i+1),opt,make_args,url,auth,rounds,max_bytes))
+        self.result['done'] = i + 1
+
+      winner = self.pick(results)
+      self.result.update(state='done',finished=int(time.time()),winner=winner and winner['opt'])
+      logger.info('tune suo5 options: %s',winner and winner['opt'])
+      return self.result
+    except:
+      logger.warning(traceback.format_exc())
+      self.result.update(state='failed',finished=int(time.time()))
+      return self.result
+    finally:
+      self._lock.release()
@@ -0,0 +1,200 @@
+# tunnel.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os, time, signal, socket, traceback
+from threading import Thread, RLock
+
+from .aio_loop import run_sync
+from .front_proxy import Backend, FrontProxy
+from .supervisor import Supervisor, find_orphans
+
+def wait_listening(addr, timeout=5, proc=None):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    if proc and not proc.running: break   # exited, such as invalid arguments
+    try:
+      socket.create_connection(addr,timeout=1).close()
+      return True
+    except OSError:
+      time.sleep(0.1)
+  return False
+
+def _run_parallel(fn, items):   # [fn(item), ...] that run in threads
+  ret = [False] * len(items)
+  def run(i):
+    try:
+      ret[i] = fn(items[i])
+    except:
+      logger.warning(traceback.format_exc())
+
+  threads = [Thread(target=run,args=(i,)) for i in range(len(items))]
+  for th in threads: th.start()
+  for th in threads: th.join()
+  return ret
+
+class Suo5Tunnel:   # blue/green groups of suo5 clients behind one front listener
+  def __init__(self, pattern='suo5/suo5-'):
+    self.pattern = pattern
+    self.front = FrontProxy()
+    self.groups = ([],[])   # 2 groups of Backend, each has backend_num items
+    self.current = []       # group in service
+    self.drain_timeout = 60
+    self.restart_fn = None  # called when a current client exits unexpectedly and can not respawn
+    self.on_change = None   # on_change(reason) called when process started, exited or rotated
+    self.rotations = 0
+    self._lock = RLock()
+
+  @property
+  def running(self):
+    return any(bk.proc.running for bk in self.current)
+
+  @property
+  def pids(self):
+    return [bk.proc.pid for bk in self.current if bk.proc.running]
+
+  @property
+  def pid(self):
+    b = self.pids
+    return b[0] if b else 0
+
+  def setup(self, local_host, fallback_cmd='', drain_timeout=60, backend_num=1, output=None):
+    # output(backend_name,stream,line) receives every output line of suo5 clients
+    host, port = local_host.rsplit(':',maxsplit=1)
+    port = int(port)
+    num = max(1,int(backend_num))
+    self.drain_timeout = drain_timeout
+
+    # group a listens at 127.0.0.1:<port+1> ... <port+num>, group b follows it
+    for i in range(2 * num):
+      name = 'suo5-%s%i' % ('ab'[i // num],i % num + 1)
+      bk_port = port + 1 + i
+      proc = Supervisor(name,(self.pattern,'127.0.0.1:%i' % bk_port),fallback_cmd)
+      bk = Backend(name,bk_port,proc)
+      if output: bk.output = lambda stream, line, name=name: output(name,stream,line)
+      proc.restart_fn = lambda bk=bk: self._auto_restart(bk)
+      proc.on_change = lambda: self._changed('process')
+      self.groups[i // num].append(bk)
+
+    # adopt clients started by previous process, kill others (such as old one listening at local_host)
+    adopted = []
+    for group in self.groups:
+      for bk in group:
+        bk.proc.adopt_orphans()
+        if bk.proc.running:
+          adopted.append(bk.proc.pid)
+          if not self.current: self.current = group
+      if group is not self.current:
+        for bk in group:
+          if bk.proc.running: bk.proc.stop(kill_orphans=False)
+    for pid in find_orphans(self.pattern,fallback_cmd,adopted):
+      try:
+        os.kill(pid,signal.SIGKILL)
+      except OSError: pass
+
+    if self.current: self.front.switch(self.current)
+    run_sync(self.front.listen(host,port),10)
+
+  def state(self):
+    group = self.current
+    return { 'current': self._group_name(group), 'rotations': self.rotations,
+      'backends': [ dict(name=bk.name,port=bk.addr[1],active=bk.active,total=bk.total,healthy=bk.healthy,
+          bytes_up=bk.bytes_up,bytes_down=bk.bytes_down,**bk.proc.state())
+        for bk in self.backends ] }
+
+  @property
+  def backends(self):
+    return self.groups[0] + self.groups[1]
+
+  def _changed(self, reason):
+    if self.on_change: self.on_change(reason)
+
+  def _group_name(self, group):
+    if not group: return ''
+    return 'a' if group is self.groups[0] else 'b'
+
+  def _auto_restart(self, bk):
+    with self._lock:
+      if bk not in self.current: return
+      if bk.args:    # respawn this one only
+        if bk.proc.spawn(bk.args,bk.output,check_wait=0) and wait_listening(bk.addr,proc=bk.proc):
+          return
+        bk.healthy = False
+    if self.restart_fn: self.restart_fn()
+
+  def start(self, make_args, check_fn, force=False):
+    # start a group of suo5 clients, or rotate to new group when current group is running
+    # make_args(listen_host) returns command line, check_fn(backend) returns True when new client works well
+    with self._lock:
+      old = self.current
+      new = self.groups[1] if old is self.groups[0] else self.groups[0]
+      old_ok = any(bk.proc.running for bk in old)
+
+      ready = []
+      for bk in new:
+        bk.proc.stop(kill_orphans=False)   # should be stopped already
+        bk.args = make_args('127.0.0.1:%i' % bk.addr[1])
+        if bk.proc.spawn(bk.args,bk.output,check_wait=0):
+          ready.append(bk)
+
+      listening = _run_parallel(lambda bk: wait_listening(bk.addr,proc=bk.proc),ready)
+      for bk, ok in zip(ready[:],listening):
+        if not ok:
+          logger.warning('%s not listening, give up',bk.name)
+          bk.proc.stop(kill_orphans=False)
+          ready.remove(bk)
+      if not ready: return False
+
+      if old_ok:
+        checked = _run_parallel(check_fn,ready)
+        for bk, ok in zip(ready,checked):
+          bk.healthy = bool(ok)
+        if not any(checked) and not force:
+          logger.warning('%s check failed, keep using %s',[bk.name for bk in ready],[bk.name for bk in old])
+          for bk in new: bk.proc.stop(kill_orphans=False)
+          return False
+      else:
+        for bk in ready: bk.healthy = True
+
+      for bk in new:
+        if bk not in ready: bk.healthy = False
+      self.current = new
+      self.front.switch(new)
+      self._changed('rotation' if old_ok else 'process')
+      if old_ok:
+        self.rotations += 1
+        th = Thread(target=self._drain,args=(old,),name='Suo5Drain')
+        th.daemon = True
+        th.start()
+      return True
+
+  def check_backends(self, check_fn):   # take unhealthy backends out of rotation
+    group = self.current
+    checked = _run_parallel(lambda bk: bk.proc.running and check_fn(bk),group)
+    for bk, ok in zip(group,checked):
+      ok = bool(ok)
+      if ok != bk.healthy:
+        logger.info('%s becomes %s',bk.name,'healthy' if ok else 'unhealthy')
+        bk.healthy = ok
+    return sum(1 for ok in checked if ok)
+
+  def _drain(self, old):
+    try:
+      if not self.front.wait_drained(old,self.drain_timeout):
+        logger.info('group %s still has %i connections, stop anyway',self._group_name(old),sum(bk.active for bk in old))
+      with self._lock:
+        if old is not self.current:
+          for bk in old: bk.proc.stop(kill_orphans=False)
+    except:
+      logger.warning(traceback.format_exc())
+
+  def stop(self):
+    with self._lock:
+      self.current = []
+      self.front.switch([])
+      ret = True
+      for bk in self.backends:
+        if not bk.proc.stop(kill_orphans=False):
+          ret = False
+      return ret
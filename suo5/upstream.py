@@ -0,0 +1,162 @@
+# upstream.py
+
+import logging
+logger = logging.getLogger(__name__)
+
+import asyncio, ssl, time
+from urllib.parse import urlsplit
+
+from .prober import ProbeError, read_response
+
+def parse_urls(value):   # 'url' or 'url1\nurl2' or [url,...] --> [url,...]
+  if isinstance(value,str): value = value.split()
+  ret = []
+  for url in value or ():
+    url = str(url).strip()
+    if url and url not in ret: ret.append(url)
+  return ret
+
+def _ewma(old, new, alpha=0.3):
+  return new if old is None else old * (1 - alpha) + new * alpha
+
+class Upstream:
+  def __init__(self, url):
+    self.url = url
+    self.connect = None     # smoothed seconds of TCP connecting
+    self.rtt = None         # smoothed seconds of direct request, including TLS handshake
+    self.throughput = None  # smoothed bytes/s through tunnel while it is in use
+    self.healthy = True
+    self.probes = 0
+    self.probe_fails = 0    # continuous direct probe failures
+    self.check_fails = 0    # continuous tunnel check failures while it is in use
+    self.failovers = 0      # times of switching away from it
+    self.demoted = 0        # monotonic time until which it is not preferred
+    self.last_error = ''
+
+  def stats(self):
+    ms = lambda v: None if v is None else int(v * 1000)
+    return { 'url': self.url, 'healthy': self.healthy, 'rtt_ms': ms(self.rtt), 'connect_ms': ms(self.connect),
+      'throughput_kbps': None if self.throughput is None else int(self.throughput * 8 / 1000),
+      'probes': self.probes, 'probe_fails': self.probe_fails, 'check_fails': self.check_fails,
+      'failovers': self.failovers, 'last_error': self.last_error }
+
+class UpstreamPool:   # several suo5 servers, measure them directly and choose the best one
+  def __init__(self, fail_limit=2, timeout=10, demote_time=600):
+    self.fail_limit = fail_limit   # failover after this many continuous failures
+    self.timeout = timeout
+    self.demote_time = demote_time
+    self.upstreams = []
+    self.current = None
+    self.failovers = 0
+    self._ssl_ctx = None
+    self._traffic = None    # (monotonic,total_bytes) of last throughput sample
+
+  def config(self, urls):   # keep measurements of unchanged urls
+    old = {u.url: u for u in self.upstreams}
+    self.upstreams = [old.get(url) or Upstream(url) for url in urls]
+    if self.current not in self.upstreams: self.current = None
+
+  def find(self, url):
+    for u in self.upstreams:
+      if u.url == url: return u
+    return None
+
+  def best(self, exclude=None):   # healthy and not demoted first, then lowest RTT, then configured order
+    now = time.monotonic()
+    candidates = [u for u in self.upstreams if u is not exclude]
+    if not candidates: return None
+    return min(candidates,key=lambda u: (not u.healthy,u.demoted > now,
+      u.rtt is None,u.rtt or 0,self.upstreams.index(u)))
+
+  def use(self, upstream):
+    if upstream is not self.current:
+      self.current = upstream
+      self._traffic = None
+
+  def on_check(self, ok):   # result of tunnel check of current upstream, return new upstream when failing over
+    cur = self.current
+    if cur is None: return None
+    if ok:
+      cur.check_fails = 0
+      return None
+
+    cur.check_fails += 1
+    if cur.check_fails < self.fail_limit: return None
+    nxt = self.best(exclude=cur)
+    if nxt is None or not nxt.healthy: return None   # nothing better, keep retrying current one
+
+    cur.check_fails = 0
+    cur.failovers += 1
+    cur.demoted = time.monotonic() + self.demote_time
+    self.failovers += 1
+    logger.warning('suo5 upstream failover: %s --> %s',cur.url,nxt.url)
+    self.use(nxt)
+    return nxt
+
+  def sample_traffic(self, total_bytes, min_bytes=65536):   # total_bytes is counter of tunnel traffic
+    now = time.monotonic()
+    last = self._traffic
+    self._traffic = (now,total_bytes)
+    if last is None or self.current is None: return
+    delta = total_bytes - last[1]
+    if delta >= min_bytes and now > last[0]:   # skip idle period, it says nothing about bandwidth
+      self.current.throughput = _ewma(self.current.throughput,delta / (now - last[0]))
+
+  async def _probe(self, u, user_agent):
+    url = urlsplit(u.url)
+    is_https = url.scheme == 'https'
+    host = url.hostname
+    port = url.port or (443 if is_https else 80)
+    path = url.path or '/'
+    if url.query: path += '?' + url.query
+    host_hdr = host if url.port is None else '%s:%i' % (host,url.port)
+
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host,port),self.timeout)
+    try:
+      connected = time.perf_counter()
+      if is_https:
+        if self._ssl_ctx is None:
+          self._ssl_ctx = ssl.create_default_context()   # verify certificate, same as prober
+        await asyncio.wait_for(writer.start_tls(self._ssl_ctx,server_hostname=host),self.timeout)
+      writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\nAccept: */*\r\nConnection: close\r\n\r\n' % (path,host_hdr,user_agent)).encode('utf-8'))
+      status, body, keep_alive = await read_response(reader,self.timeout)
+      if body[:2] != b'OK': raise ProbeError('unexpected response, status=%i' % status)
+      return (connected - start,time.perf_counter() - start)
+    finally:
+      writer.close()
+
+  async def _measure_one(self, u, user_agent):
+    u.probes += 1
+    try:
+      connect, rtt = await self._probe(u,user_agent)
+    except asyncio.TimeoutError:
+      err = 'timeout'
+    except (ProbeError,OSError,ValueError,asyncio.IncompleteReadError,asyncio.LimitOverrunError) as e:
+      err = str(e) or e.__class__.__name__
+    else:
+      u.connect = _ewma(u.connect,connect)
+      u.rtt = _ewma(u.rtt,rtt)
+      u.probe_fails = 0
+      u.healthy = True
+      u.last_error = ''
+      return True
+
+    u.probe_fails += 1
+    u.last_error = err
+    if u.healthy and u.probe_fails >= self.fail_limit:
+      u.healthy = False
+      logger.info('suo5 upstream %s is down: %s',u.url,err)
+    return False
+
+  async def measure(self, user_agent):   # probe all upstreams concurrently, return number of reachable ones
+    ret = await asyncio.gather(*[self._measure_one(u,user_agent) for u in self.upstreams])
+    return sum(ret)
+
+  def stats(self):
+    ret = []
+    for u in self.upstreams:
+      item = u.stats()
+      item['active'] = u is self.current
+      ret.append(item)
+    return ret